@@ -0,0 +1,246 @@
+"""
+Zwischenspeicher der verarbeiteten Alma-Daten im Arrow-IPC-Format
+Exporte (XLSX/CSV) und das erneute Anwenden geänderter Mappings laufen aus diesem Frame,
+ohne die Bestelllisten erneut zu verarbeiten.
+pyarrow ist optional: ohne pyarrow wird kein Frame geschrieben.
+"""
+
+import os
+import stat
+import tempfile
+
+# Spalten der Dublettenkontrolle (gleiche Reihenfolge wie in DuplicateChecker)
+DUPLICATE_COLUMNS = ['Dublette', 'Anzahl Treffer', '338$a', '020$a (SRU)']
+
+# Spaltenüberschriften im Export, falls abweichend vom Namen im Frame
+EXPORT_HEADERS = {'020$a (SRU)': '020$a'}
+
+# Hilfsspalten (nicht exportiert): Werte vor dem Anwenden der Mappings
+RAW_949D = '_raw_949$d'
+
+# umask einmal beim Import lesen (os.umask lässt sich nur setzend abfragen)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def unique_temp_path(path):
+    """
+    Eindeutige temporäre Datei neben path. Wird nach dem Schreiben mit os.replace
+    übernommen, damit gleichzeitige Läufe sich nicht gegenseitig die Datei wegnehmen.
+    mkstemp legt die Datei mit 0600 an; sie erhält die Rechte der bestehenden Zieldatei
+    bzw. 0666 abzüglich umask, wie beim direkten Schreiben.
+    """
+    directory, name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory or '.', prefix=f"{name}.", suffix='.tmp')
+    os.close(fd)
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except OSError:
+        mode = 0o666 & ~_UMASK
+    os.chmod(tmp_path, mode)
+    return tmp_path
+
+
+def write_atomic(path, write):
+    """
+    Schreibt path über eine eindeutige temporäre Datei, damit Leser nie eine halb
+    geschriebene Datei sehen
+
+    Args:
+        path (str): Zieldatei
+        write (callable): Schreibt die Datei, erhält den temporären Pfad
+    """
+    tmp_path = unique_temp_path(path)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def pyarrow_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class AlmaFrameWriter:
+    def __init__(self, path, columns):
+        """
+        Schreibt den Frame blockweise (eine Record-Batch pro Aufruf von write_rows)
+
+        Args:
+            path (str): Zieldatei (.arrow)
+            columns (list): Spaltennamen inkl. Hilfsspalten
+        """
+        import pyarrow as pa
+
+        self.path = path
+        self.columns = columns
+        self.schema = pa.schema([(column, pa.string()) for column in columns])
+        self._tmp_path = unique_temp_path(path)
+        self._writer = pa.ipc.new_file(self._tmp_path, self.schema)
+
+    def write_rows(self, rows):
+        import pyarrow as pa
+
+        if not rows:
+            return
+        arrays = [pa.array([_to_text(row[i]) for row in rows], pa.string()) for i in range(len(self.columns))]
+        self._writer.write_batch(pa.record_batch(arrays, schema=self.schema))
+
+    def close(self):
+        self._writer.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        try:
+            self._writer.close()
+        finally:
+            if os.path.exists(self._tmp_path):
+                os.remove(self._tmp_path)
+
+
+class AlmaFrame:
+    def __init__(self, path):
+        """
+        Zugriff auf den gespeicherten Alma-Frame
+
+        Args:
+            path (str): Pfad zur .arrow-Datei
+        """
+        self.path = path
+
+    def exists(self):
+        return os.path.exists(self.path) and pyarrow_available()
+
+    def remove(self):
+        """Verwirft den Frame (z.B. wenn er nicht mehr lesbar ist)"""
+        try:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        except OSError as e:
+            print(f"[WARNING] Alma-Frame konnte nicht entfernt werden: {e}")
+
+    def read(self):
+        """
+        Liest den Frame memory-mapped
+
+        Returns:
+            pyarrow.Table: Tabelle mit allen Spalten (Strings)
+        """
+        import pyarrow as pa
+
+        with pa.memory_map(self.path, 'r') as source:
+            return pa.ipc.open_file(source).read_all()
+
+    def write(self, table):
+        import pyarrow as pa
+
+        def write_ipc(tmp_path):
+            with pa.OSFile(tmp_path, 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+
+        write_atomic(self.path, write_ipc)
+
+    def replace_columns(self, values_by_column):
+        """
+        Ersetzt oder ergänzt einzelne Spalten; alle übrigen Spalten bleiben unverändert
+
+        Args:
+            values_by_column (dict): Spaltenname -> Liste der Werte (eine pro Zeile)
+        """
+        import pyarrow as pa
+
+        table = self.read()
+        for column, values in values_by_column.items():
+            array = pa.array([_to_text(v) for v in values], pa.string())
+            if column in table.column_names:
+                table = table.set_column(table.column_names.index(column), column, array)
+            else:
+                table = table.append_column(column, array)
+        self.write(table)
+
+    def attach_duplicate_results(self, results_by_row):
+        """
+        Übernimmt die Ergebnisse der Dublettenkontrolle
+
+        Args:
+            results_by_row (dict): Excel-Zeilennummer (ab 2) -> Ergebnis aus iter_duplicate_check
+        """
+        table = self.read()
+        columns = {column: [''] * table.num_rows for column in DUPLICATE_COLUMNS}
+        for row_idx, result in results_by_row.items():
+            index = row_idx - 2
+            if not 0 <= index < table.num_rows:
+                continue
+            columns['Dublette'][index] = result['status']
+            columns['Anzahl Treffer'][index] = result.get('error', '') if result['status'] == 'FEHLER' else result['count']
+            columns['338$a'][index] = result.get('carrier', '')
+            columns['020$a (SRU)'][index] = result.get('isbn_sru', '')
+        self.replace_columns(columns)
+
+    def export_columns(self, table):
+        return [c for c in table.column_names if not c.startswith('_')]
+
+    def export_xlsx(self, output_path, numeric_columns=('264$c', 'Anzahl Treffer')):
+        """
+        Schreibt den Frame als Excel-Datei (write-only, blockweise)
+
+        Args:
+            output_path (str): Zieldatei
+            numeric_columns (tuple): Spalten, deren Ziffernwerte als Zahl geschrieben werden
+        """
+        from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import PatternFill, Font
+
+        table = self.read()
+        columns = self.export_columns(table)
+        table = table.select(columns)
+
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Importdaten Alma")
+        ws.append([EXPORT_HEADERS.get(c, c) for c in columns])
+
+        # Dubletten wie in DuplicateChecker markieren
+        yellow_fill = PatternFill(start_color='FFFF00', end_color='FFFF00', fill_type='solid')
+        red_font = Font(color='FF0000', bold=True)
+        has_duplicates = 'Dublette' in columns
+        duplicate_idx = columns.index('Dublette') if has_duplicates else None
+        numeric_idx = {columns.index(c) for c in numeric_columns if c in columns}
+
+        for batch in table.to_batches():
+            for record in zip(*(column.to_pylist() for column in batch.columns)):
+                values = [int(v) if i in numeric_idx and v and v.isdigit() else v for i, v in enumerate(record)]
+                if has_duplicates and values[duplicate_idx] == 'JA':
+                    flag = WriteOnlyCell(ws, value='JA')
+                    flag.fill = yellow_fill
+                    flag.font = red_font
+                    count = WriteOnlyCell(ws, value=values[duplicate_idx + 1])
+                    count.fill = yellow_fill
+                    values[duplicate_idx] = flag
+                    values[duplicate_idx + 1] = count
+                ws.append(values)
+
+        write_atomic(output_path, wb.save)
+
+    def export_csv(self, output_path):
+        """
+        Schreibt den Frame als CSV (UTF-8 mit BOM, wie die Mapping-Dateien)
+        """
+        table = self.read()
+        columns = self.export_columns(table)
+        df = table.select(columns).to_pandas()
+        df.columns = [EXPORT_HEADERS.get(c, c) for c in columns]
+        write_atomic(output_path, lambda tmp_path: df.to_csv(tmp_path, index=False, encoding='utf-8-sig'))
+
+
+def _to_text(value):
+    if value is None:
+        return ''
+    return str(value)
@@ -1,10 +1,45 @@
-import pandas as pd
-from flask import flash
 import os
+from processing_report import ProcessingReport
+
+# Geladene Mappings pro Datei, gültig solange sich der Änderungszeitpunkt nicht ändert.
+# Wird im gunicorn-Master vorgewärmt (siehe main.warm_caches) und von den Workern geteilt.
+_mapping_cache = {}
+
+
+def read_mapping(path, key_column, value_column):
+    """
+    Liest ein CSV-Mapping als Dictionary, mit Cache pro Datei und Änderungszeitpunkt
+
+    Args:
+        path (str): Pfad zur CSV-Datei
+        key_column (str): Spalte mit den Schlüsseln
+        value_column (str): Spalte mit den Werten
+
+    Returns:
+        dict | None: Mapping oder None, wenn eine der Spalten fehlt
+    """
+    mtime = os.path.getmtime(path)
+    cached = _mapping_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    # pandas erst bei Bedarf laden (schnellerer Start von main.py)
+    import pandas as pd
+
+    df = pd.read_csv(path)
+    if key_column in df.columns and value_column in df.columns:
+        mapping = dict(zip(df[key_column], df[value_column]))
+    else:
+        mapping = None
+
+    _mapping_cache[path] = (mtime, mapping)
+    return mapping
+
 
 class CSVLoader:
-    def __init__(self, paths):
+    def __init__(self, paths, report=None):
         self.paths = paths
+        self.report = report if report is not None else ProcessingReport()
         self.mapping_949v = {}
         self.mapping_949d = {}
         self.mapping_949x = {}
@@ -17,61 +52,61 @@ class CSVLoader:
         try:
             # Mapping 949v
             if os.path.exists(self.paths["csv_mapping_949v"]):
-                df = pd.read_csv(self.paths["csv_mapping_949v"])
-                if '264$b' in df.columns and '949$v' in df.columns:
-                    self.mapping_949v = dict(zip(df['264$b'], df['949$v']))
-                    flash("Mapping 949v erfolgreich geladen.", 'success')
+                mapping = read_mapping(self.paths["csv_mapping_949v"], '264$b', '949$v')
+                if mapping is not None:
+                    self.mapping_949v = mapping
+                    self.report.success("Mapping 949v erfolgreich geladen.")
                 else:
-                    flash("Fehlende Spalten in csv_mapping_949v.csv", 'error')
+                    self.report.error("Fehlende Spalten in csv_mapping_949v.csv")
 
             # Mapping 949d
             if os.path.exists(self.paths["csv_mapping_949d"]):
-                df = pd.read_csv(self.paths["csv_mapping_949d"])
-                if '905$n' in df.columns and '949$d' in df.columns:
-                    self.mapping_949d = dict(zip(df['905$n'], df['949$d']))
-                    flash("Mapping 949d erfolgreich geladen.", 'success')
+                mapping = read_mapping(self.paths["csv_mapping_949d"], '905$n', '949$d')
+                if mapping is not None:
+                    self.mapping_949d = mapping
+                    self.report.success("Mapping 949d erfolgreich geladen.")
                 else:
-                    flash("Fehlende Spalten in csv_mapping_949d.csv", 'error')
+                    self.report.error("Fehlende Spalten in csv_mapping_949d.csv")
 
             # Mapping 949x
             if os.path.exists(self.paths["csv_mapping_949x"]):
-                df = pd.read_csv(self.paths["csv_mapping_949x"])
-                if '905$n' in df.columns and '949$x' in df.columns:
-                    self.mapping_949x = dict(zip(df['905$n'], df['949$x']))
-                    flash("Mapping 949x erfolgreich geladen.", 'success')
+                mapping = read_mapping(self.paths["csv_mapping_949x"], '905$n', '949$x')
+                if mapping is not None:
+                    self.mapping_949x = mapping
+                    self.report.success("Mapping 949x erfolgreich geladen.")
                 else:
-                    flash("Fehlende Spalten in csv_mapping_949x.csv", 'error')
+                    self.report.error("Fehlende Spalten in csv_mapping_949x.csv")
 
             # Mapping 905o
             if os.path.exists(self.paths["csv_mapping_905o"]):
-                df = pd.read_csv(self.paths["csv_mapping_905o"])
-                if '905$n' in df.columns and '905$o' in df.columns:
-                    self.mapping_905o = dict(zip(df['905$n'], df['905$o']))
-                    flash("Mapping 905o erfolgreich geladen.", 'success')
+                mapping = read_mapping(self.paths["csv_mapping_905o"], '905$n', '905$o')
+                if mapping is not None:
+                    self.mapping_905o = mapping
+                    self.report.success("Mapping 905o erfolgreich geladen.")
                 else:
-                    flash("Fehlende Spalten in csv_mapping_905o.csv", 'error')
+                    self.report.error("Fehlende Spalten in csv_mapping_905o.csv")
 
             # Mapping articles
             if os.path.exists(self.paths["csv_mapping_articles"]):
-                df = pd.read_csv(self.paths["csv_mapping_articles"])
-                if 'article' in df.columns and 'formatted_article' in df.columns:
-                    self.articles = dict(zip(df['article'], df['formatted_article']))
-                    flash("Mapping articles erfolgreich geladen.", 'success')
+                mapping = read_mapping(self.paths["csv_mapping_articles"], 'article', 'formatted_article')
+                if mapping is not None:
+                    self.articles = mapping
+                    self.report.success("Mapping articles erfolgreich geladen.")
                 else:
-                    flash("Fehlende Spalten in csv_mapping_articles.csv", 'error')
+                    self.report.error("Fehlende Spalten in csv_mapping_articles.csv")
 
             # Mapping sonderzeichen
             if os.path.exists(self.paths["csv_mapping_sonderzeichen"]):
-                df = pd.read_csv(self.paths["csv_mapping_sonderzeichen"])
-                if 'original' in df.columns and 'replacement' in df.columns:
-                    self.sonderzeichen = dict(zip(df['original'], df['replacement']))
-                    flash("Mapping sonderzeichen erfolgreich geladen.", 'success')
+                mapping = read_mapping(self.paths["csv_mapping_sonderzeichen"], 'original', 'replacement')
+                if mapping is not None:
+                    self.sonderzeichen = mapping
+                    self.report.success("Mapping sonderzeichen erfolgreich geladen.")
                 else:
-                    flash("Fehlende Spalten in csv_mapping_sonderzeichen.csv", 'error')
+                    self.report.error("Fehlende Spalten in csv_mapping_sonderzeichen.csv")
 
             return True
 
         except Exception as e:
-            flash(f"Fehler beim Laden der CSV-Dateien: {str(e)}", 'error')
+            self.report.error(f"Fehler beim Laden der CSV-Dateien: {str(e)}")
             print(f"Fehler beim Laden der CSV-Dateien: {str(e)}")
             return False
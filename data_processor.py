@@ -1,14 +1,30 @@
 import os
-import pandas as pd
-from openpyxl import Workbook
-from flask import flash
+from alma_frame import AlmaFrame, AlmaFrameWriter, RAW_949D, pyarrow_available, write_atomic
 from csv_loader import CSVLoader
+from memory_usage import current_rss_mb, peak_rss_mb
+from processing_report import ProcessingReport
+
+
+# Alma-Spalte -> Spalte in der Bestellliste der Fachreferate
+COLUMNS_MAPPING = {
+    "905$n": "Bibliothek",
+    "020$a": "ISBN",
+    "24510$c": "Autor(en)",
+    "24510$a": "Titel",
+    "264$b": "Verlag",
+    "949$s": "Preis Euro",
+    "949$u": "Etat",
+    "949$d": "Auflage/Ausgabe",
+    "949$z": "Interne Bemerkung"
+}
 
 
 class DataProcessor:
-    def __init__(self, paths, current_year):
+    def __init__(self, paths, current_year, report=None):
         self.paths = paths
         self.current_year = current_year
+        # Meldungen werden gesammelt und erst in der Route als flash() ausgegeben
+        self.report = report if report is not None else ProcessingReport()
         self.columns = [
             "LDR", "008", "020$a", "040$a", "040$b", "040$e", "24510$a", "24510$c",
             "264$a", "264$b", "264$c", "336$b", "336$2",
@@ -47,9 +63,10 @@ class DataProcessor:
         if not os.path.exists(output_folder):
             os.makedirs(output_folder)
         self.paths["output_file"] = os.path.join(output_folder, "output.xlsx")
+        self.paths["alma_frame"] = os.path.join(output_folder, "alma_frame.arrow")
 
         # CSVLoader initialisieren und Mappings laden
-        self.csv_loader = CSVLoader(paths)
+        self.csv_loader = CSVLoader(paths, self.report)
         if not self.csv_loader.load_csv_mappings():
             raise Exception("Fehler beim Laden der CSV-Mappings")
 
@@ -62,145 +79,392 @@ class DataProcessor:
         self.sonderzeichen = self.csv_loader.sonderzeichen
 
     def process_files(self, saved_files):
+        # pandas und openpyxl erst bei Bedarf laden (schnellerer Start von main.py)
+        import pandas as pd
+        from openpyxl import Workbook
+
         wb = Workbook()
         ws = wb.active
         ws.title = "Importdaten Alma"
 
         # Spaltenüberschriften setzen
-        for col_num, column_title in enumerate(self.columns, 1):
-            ws.cell(row=1, column=col_num, value=column_title)
+        ws.append(self.columns)
 
-        start_row = 2
+        frame_writer = self._open_frame_writer()
 
         for file in saved_files:
+            frame_rows = []
             try:
                 df = pd.read_excel(file).fillna('')
 
                 for _, row in df.iterrows():
-                    # Durch alle Spalten iterieren und Werte setzen
-                    for column_title in self.columns:
-                        if column_title in self.columns_mapping_dict():
-                            # Wert aus dem Mapping holen
-                            old_column = self.columns_mapping_dict()[column_title]
-                            value = str(row.get(old_column, '')).strip()
-                        else:
-                            # Setze den Wert auf einen leeren String, wenn es kein Mapping gibt
-                            value = ''
-
-                        # Sonderzeichen ersetzen
-                        for original, replacement in self.sonderzeichen.items():
-                            value = value.replace(original, replacement)
-
-                        # Bindestriche in ISBN und .0 am Ende des Wertes entfernen
-                        if column_title == "020$a":
-                            value = value.replace('-', '')  # Bindestriche entfernen
-                            value = value.split('.')[0]      # Entfernt '.0' am Ende des Wertes
-
-                        # Artikel werden in <<>>-Klammern gesetzt. Die Artikel befinden sich im Articles-Mapping.
-                        if column_title == "24510$a":
-                            title = str(value)
-                            for article, formatted_article in self.articles.items():
-                                if title.lower().startswith(article + ' '):
-                                    title = formatted_article + ' ' + title[len(article) + 1:]
-                                    break
-                            value = title
-
-                        # Wenn der Wert leer ist, den Standardwert setzen
-                        value_to_set = value if value else self.default_values.get(column_title, '')
-
-                        # Wert in Excel-Zelle schreiben
-                        col_num = self.columns.index(column_title) + 1
-                        ws.cell(row=start_row, column=col_num, value=value_to_set)
-
-                    # Zusätzliche Mappings anwenden
-                    self._process_905o(ws, start_row)
-                    self._process_949x(ws, start_row)
-                    self._process_949d(ws, start_row)
-                    self._process_949v(ws, start_row)
-                    self._process_905c(ws, start_row)
-
-                    start_row += 1
+                    values, raw_949d = self._build_row(row)
+
+                    # Zeilen ohne Titel (24510$a) werden nicht übernommen
+                    if self._has_title(values):
+                        ws.append(values)
+                        frame_rows.append(values + [raw_949d])
+                        self.report.rows_written += 1
+                        self._report_unmapped_905c(values)
+                    else:
+                        self.report.rows_skipped += 1
+
+                self.report.files_processed += 1
+                self.report.sample_rss(current_rss_mb())
+
+            except Exception as e:
+                self.report.file_error(file, e)
+                print(f"Fehler beim Verarbeiten der Datei {file}: {e}")
+            finally:
+                frame_writer = self._write_frame_rows(frame_writer, frame_rows)
+
+        self._save(wb, frame_writer)
+        self._finish_rss()
+        return self.report
+
+    def process_files_chunked(self, saved_files, chunk_size=1000, memory_warning_mb=None):
+        """
+        Verarbeitet die Dateien blockweise mit begrenztem Speicherbedarf.
+        Eingabe (openpyxl read-only) und Ausgabe (write-only) werden zeilenweise
+        gestreamt, sodass nie die ganze Datei im Speicher liegt.
+
+        Args:
+            saved_files (list): Pfade der Eingabedateien
+            chunk_size (int): Anzahl Zeilen pro Block
+            memory_warning_mb (float, optional): Warnschwelle für den RSS. Wird sie
+                überschritten, wird eine Warnung ausgegeben und im Report vermerkt;
+                die Verarbeitung läuft weiter. Ohne aktuellen RSS (kein /proc) entfällt die Prüfung.
+
+        Returns:
+            ProcessingReport: Report des Laufs inkl. Spitzenwert des RSS
+        """
+        from openpyxl import Workbook
+
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Importdaten Alma")
+        ws.append(self.columns)
+
+        self.report.chunk_size = chunk_size
+        self.report.sample_rss(current_rss_mb())
+
+        frame_writer = self._open_frame_writer()
+
+        for file in saved_files:
+            frame_rows = []
+            try:
+                rows = self._iter_excel_rows(file)
+                for batch in self._iter_batches(rows, chunk_size):
+                    for values, raw_949d in self._transform_batch(batch):
+                        ws.append(values)
+                        frame_rows.append(values + [raw_949d])
+                    frame_writer = self._write_frame_rows(frame_writer, frame_rows)
+                    frame_rows = []
+                    self._check_memory_warning(memory_warning_mb)
+
+                self.report.files_processed += 1
 
             except Exception as e:
-                flash(f"Fehler beim Verarbeiten der Datei {file}: {e}", 'error')
+                self.report.file_error(file, e)
                 print(f"Fehler beim Verarbeiten der Datei {file}: {e}")
+            finally:
+                frame_writer = self._write_frame_rows(frame_writer, frame_rows)
+
+        self._save(wb, frame_writer)
+        self.report.sample_rss(current_rss_mb())
+        self._finish_rss()
+        return self.report
+
+    def _iter_excel_rows(self, file):
+        """
+        Liest eine Excel-Datei zeilenweise, ohne sie ganz zu laden.
+
+        Yields:
+            dict: Spaltenname -> Wert (leere Zellen als '')
+        """
+        from openpyxl import load_workbook
+
+        wb = load_workbook(file, read_only=True, data_only=True)
+        try:
+            rows = wb.active.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            header = ['' if h is None else h for h in header]
+            for values in rows:
+                yield {h: ('' if v is None else v) for h, v in zip(header, values)}
+        finally:
+            wb.close()
+
+    def _iter_batches(self, rows, chunk_size):
+        """Fasst Zeilen zu Blöcken von chunk_size Zeilen zusammen."""
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= chunk_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _transform_batch(self, batch):
+        for row in batch:
+            values, raw_949d = self._build_row(row)
+            if self._has_title(values):
+                self.report.rows_written += 1
+                self._report_unmapped_905c(values)
+                yield values, raw_949d
+            else:
+                self.report.rows_skipped += 1
+
+    def _check_memory_warning(self, memory_warning_mb):
+        # Nur eine Warnung: Ein- und Ausgabe werden bereits gestreamt, kleinere Blöcke
+        # würden den Speicherbedarf kaum senken
+        rss = current_rss_mb()
+        self.report.sample_rss(rss)
+        if memory_warning_mb and rss is not None and rss > memory_warning_mb and not self.report.memory_warning:
+            self.report.memory_warning = True
+            print(f"[WARNING] Warnschwelle Speicher überschritten: {rss:.0f} MB > {memory_warning_mb} MB")
+
+    def _finish_rss(self):
+        # Ohne /proc ist nur der Spitzenwert des ganzen Prozesses verfügbar
+        if self.report.peak_rss_mb is None:
+            self.report.peak_rss_mb = peak_rss_mb()
+
+    def _open_frame_writer(self):
+        """Writer für den Alma-Frame, None ohne pyarrow oder wenn der Frame nicht angelegt werden kann"""
+        if pyarrow_available():
+            try:
+                return AlmaFrameWriter(self.paths["alma_frame"], self.columns + [RAW_949D])
+            except Exception as e:
+                self._frame_failed(e)
+        self._remove_stale_frame()
+        return None
+
+    def _write_frame_rows(self, frame_writer, rows):
+        """
+        Schreibt Zeilen in den Alma-Frame. Der Frame ist nur ein Zwischenspeicher:
+        Fehler brechen die Verarbeitung nicht ab, der Frame wird dann verworfen.
+
+        Returns:
+            AlmaFrameWriter | None: Writer für die weiteren Zeilen, None nach einem Fehler
+        """
+        if frame_writer is None:
+            return None
+        try:
+            frame_writer.write_rows(rows)
+            return frame_writer
+        except Exception as e:
+            self._frame_failed(e)
+            self._abort_frame(frame_writer)
+            return None
+
+    def _abort_frame(self, frame_writer):
+        try:
+            frame_writer.abort()
+        except Exception as e:
+            print(f"[WARNING] Temporärer Alma-Frame konnte nicht entfernt werden: {e}")
+        self._remove_stale_frame()
+
+    def _remove_stale_frame(self):
+        # Einen veralteten Frame eines früheren Laufs nicht weiterverwenden
+        try:
+            if os.path.exists(self.paths["alma_frame"]):
+                os.remove(self.paths["alma_frame"])
+        except OSError as e:
+            print(f"[WARNING] Veralteter Alma-Frame konnte nicht entfernt werden: {e}")
 
-        # Entferne alle Zeilen, in denen das Feld "24510$a" (Titel) leer ist.
-        self._remove_empty_rows(ws)
+    def _frame_failed(self, error):
+        self.report.frame_error = str(error)
+        print(f"[WARNING] Alma-Frame konnte nicht geschrieben werden: {error}")
 
+    def _save(self, wb, frame_writer=None):
         try:
-            wb.save(self.paths["output_file"])
-            flash("Ergebnisdatei erfolgreich gespeichert.", 'success')
+            write_atomic(self.paths["output_file"], wb.save)
+            self.report.output_saved = True
+            self.report.success("Ergebnisdatei erfolgreich gespeichert.")
             print(f"Ergebnisdatei gespeichert: {self.paths['output_file']}")
         except Exception as e:
-            flash(f"Fehler beim Speichern der Ergebnisdatei: {e}", 'error')
+            self.report.error(f"Fehler beim Speichern der Ergebnisdatei: {e}")
             print(f"Fehler beim Speichern der Ergebnisdatei: {e}")
 
+        # Frame nur übernehmen, wenn er zur gespeicherten Ergebnisdatei passt
+        if frame_writer is None:
+            return
+        if not self.report.output_saved:
+            self._abort_frame(frame_writer)
+            return
+        try:
+            frame_writer.close()
+        except Exception as e:
+            self._frame_failed(e)
+            self._abort_frame(frame_writer)
+
+    def reapply_mappings(self, columns):
+        """
+        Wendet die aktuellen Mappings erneut auf den gespeicherten Alma-Frame an,
+        nur für die angegebenen Zielspalten. Die übrigen Spalten (inkl. Ergebnisse
+        der Dublettenkontrolle) bleiben unverändert.
+
+        Args:
+            columns (list): Zielspalten, z.B. ["949$v"] (möglich: 905$o, 949$x, 949$d, 949$v, 905$c)
+
+        Returns:
+            int: Anzahl Zeilen im Frame
+        """
+        frame = AlmaFrame(self.paths["alma_frame"])
+        table = frame.read()
+
+        # Pro eindeutigem Quellwert nur einmal nachschlagen
+        values_905n = table.column("905$n").to_pylist()
+        lookups_905n = {"905$o": self._value_905o, "949$x": self._value_949x, "905$c": self._value_905c}
+        updated = {}
+        for column in columns:
+            if column in lookups_905n:
+                lookup = {v: lookups_905n[column](v) for v in set(values_905n)}
+                updated[column] = [lookup[v] for v in values_905n]
+            elif column == "949$v":
+                values_264b = table.column("264$b").to_pylist()
+                lookup = {v: self._value_949v(v) for v in set(values_264b)}
+                updated[column] = [lookup[v] for v in values_264b]
+            elif column == "949$d":
+                raw = table.column(RAW_949D).to_pylist()
+                updated[column] = [self._value_949d(v, r) for v, r in zip(values_905n, raw)]
+            else:
+                raise ValueError(f"Kein Mapping für Spalte {column}")
+
+        frame.replace_columns(updated)
+        return table.num_rows
+
+    def _build_row(self, row):
+        """
+        Wandelt eine Zeile der Bestellliste in die Werte der Alma-Spalten um.
+
+        Spaltennamen und Zellwerte werden hier vereinheitlicht, damit beide
+        Verarbeitungsmodi (pandas und openpyxl) dieselbe Ausgabe erzeugen.
+
+        Args:
+            row: Zeile als dict oder pandas.Series (Spaltenname -> Wert)
+
+        Returns:
+            tuple: (Werte in der Reihenfolge von self.columns, 949$d vor dem Mapping)
+        """
+        row = {str(header).strip(): cell for header, cell in row.items()}
+        values = []
+
+        # Durch alle Spalten iterieren und Werte setzen
+        for column_title in self.columns:
+            if column_title in self.columns_mapping_dict():
+                # Wert aus dem Mapping holen
+                old_column = self.columns_mapping_dict()[column_title]
+                value = self._cell_text(row.get(old_column))
+            else:
+                # Setze den Wert auf einen leeren String, wenn es kein Mapping gibt
+                value = ''
+
+            # Sonderzeichen ersetzen
+            for original, replacement in self.sonderzeichen.items():
+                value = value.replace(original, replacement)
+
+            # Bindestriche in ISBN und .0 am Ende des Wertes entfernen
+            if column_title == "020$a":
+                value = value.replace('-', '')  # Bindestriche entfernen
+                value = value.split('.')[0]      # Entfernt '.0' am Ende des Wertes
+
+            # Artikel werden in <<>>-Klammern gesetzt. Die Artikel befinden sich im Articles-Mapping.
+            if column_title == "24510$a":
+                title = str(value)
+                for article, formatted_article in self.articles.items():
+                    if title.lower().startswith(article + ' '):
+                        title = formatted_article + ' ' + title[len(article) + 1:]
+                        break
+                value = title
+
+            # Wenn der Wert leer ist, den Standardwert setzen
+            values.append(value if value else self.default_values.get(column_title, ''))
+
+        # 949$d vor dem Mapping, damit reapply_mappings das Mapping neu anwenden kann
+        raw_949d = values[self.columns.index("949$d")]
+
+        # Zusätzliche Mappings anwenden
+        self._process_905o(values)
+        self._process_949x(values)
+        self._process_949d(values)
+        self._process_949v(values)
+        self._process_905c(values)
+
+        return values, raw_949d
+
+    def _cell_text(self, value):
+        """
+        Zellwert als Text. Leere Zellen (None, NaN) ergeben ''. Ganzzahlige Floats werden
+        ohne '.0' geschrieben: pandas liest Zahlenspalten mit leeren Zellen als float,
+        openpyxl liefert dieselben Zellen als int.
+        """
+        if value is None or (isinstance(value, float) and value != value):
+            return ''
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        return str(value).strip()
+
+    def _has_title(self, values):
+        """Prüft, ob das Feld "24510$a" (Titel) gefüllt ist."""
+        title = values[self.columns.index("24510$a")]
+        return title is not None and str(title).strip() != ""
+
     def columns_mapping_dict(self):
         # Mapping for columns used in processing (Dictionary format for easier lookup)
-        return {
-            "905$n": "Bibliothek",
-            "020$a": "ISBN",
-            "24510$c": "Autor(en)",
-            "24510$a": "Titel",
-            "264$b": "Verlag",
-            "949$s": "Preis Euro",
-            "949$u": "Etat",
-            "949$d": "Auflage/Ausgabe",
-            "949$z": "Interne Bemerkung"
-        }
+        return COLUMNS_MAPPING
+
+    def _process_905o(self, values):
+        values[self.columns.index("905$o")] = self._value_905o(values[self.columns.index("905$n")])
 
-    def _process_905o(self, ws, row):
-        col_905n = self.columns.index("905$n") + 1
-        col_905o = self.columns.index("905$o") + 1
-        value_905n = ws.cell(row=row, column=col_905n).value
+    def _process_949x(self, values):
+        values[self.columns.index("949$x")] = self._value_949x(values[self.columns.index("905$n")])
+
+    def _process_949d(self, values):
+        col_949d = self.columns.index("949$d")
+        values[col_949d] = self._value_949d(values[self.columns.index("905$n")], values[col_949d])
+
+    def _process_949v(self, values):
+        values[self.columns.index("949$v")] = self._value_949v(values[self.columns.index("264$b")])
+
+    def _process_905c(self, values):
+        value_905n = values[self.columns.index("905$n")]
+        if value_905n and value_905n in self.mapping905c:
+            values[self.columns.index("905$c")] = self.mapping905c[value_905n]
+
+    def _report_unmapped_905c(self, values):
+        """Fehlendes 905$c-Mapping melden, nur für Zeilen, die in die Ausgabe übernommen werden"""
+        value_905n = values[self.columns.index("905$n")]
+        if value_905n not in self.mapping905c:
+            self.report.unmapped(value_905n)
+
+    # Die folgenden Funktionen berechnen den Wert einer Zielspalte aus dem Quellwert.
+    # Sie werden bei der Verarbeitung und von reapply_mappings verwendet.
+
+    def _value_905o(self, value_905n):
         if value_905n and value_905n in self.mapping_905o:
-            ws.cell(row=row, column=col_905o, value=self.mapping_905o[value_905n])
+            return self.mapping_905o[value_905n]
+        return ''
 
-    def _process_949x(self, ws, row):
-        col_905n = self.columns.index("905$n") + 1
-        col_949x = self.columns.index("949$x") + 1
-        value_905n = ws.cell(row=row, column=col_905n).value
+    def _value_949x(self, value_905n):
         if value_905n and value_905n in self.mapping_949x:
-            ws.cell(row=row, column=col_949x, value=self.mapping_949x[value_905n])
+            return self.mapping_949x[value_905n]
+        return ''
 
-    def _process_949d(self, ws, row):
-        col_905n = self.columns.index("905$n") + 1
-        col_949d = self.columns.index("949$d") + 1
-        value_905n = ws.cell(row=row, column=col_905n).value
-        current_value = ws.cell(row=row, column=col_949d).value or ''
+    def _value_949d(self, value_905n, current_value):
+        current_value = current_value or ''
         if value_905n and value_905n in self.mapping_949d:
             new_value = self.mapping_949d[value_905n]
-            combined_value = f"{new_value}, {current_value}" if current_value else new_value
-            ws.cell(row=row, column=col_949d, value=combined_value)
+            return f"{new_value}, {current_value}" if current_value else new_value
+        return current_value
 
-    def _process_949v(self, ws, row):
-        col_264b = self.columns.index("264$b") + 1
-        col_949v = self.columns.index("949$v") + 1
-        value_264b = ws.cell(row=row, column=col_264b).value
+    def _value_949v(self, value_264b):
         if value_264b:
-            value_949v = next((v for k, v in self.mapping_949v.items() if k in str(value_264b)), '')
-            ws.cell(row=row, column=col_949v, value=value_949v)
+            return next((v for k, v in self.mapping_949v.items() if k in str(value_264b)), '')
+        return ''
 
-    def _process_905c(self, ws, row):
-        col_905n = self.columns.index("905$n") + 1
-        col_905c = self.columns.index("905$c") + 1
-        value_905n = ws.cell(row=row, column=col_905n).value
+    def _value_905c(self, value_905n):
         if value_905n and value_905n in self.mapping905c:
-            mapped_value = self.mapping905c[value_905n]
-            ws.cell(row=row, column=col_905c, value=mapped_value)
-        else:
-            print(f"Kein gültiges Mapping für 905$n '{value_905n}' in Zeile {row} gefunden.")
-
-    def _remove_empty_rows(self, ws):
-        """
-        Entfernt alle Zeilen (außer der Kopfzeile), in denen das Feld "24510$a" (Titel) leer ist.
-        """
-        # Ermittle den Spaltenindex für "24510$a" (Titel)
-        title_col_index = self.columns.index("24510$a") + 1  # openpyxl verwendet 1-basierte Indizes
-
-        # Von der letzten Zeile bis zur zweiten Zeile iterieren (Kopfzeile bleibt erhalten)
-        for row in range(ws.max_row, 1, -1):
-            cell_value = ws.cell(row=row, column=title_col_index).value
-            if cell_value is None or str(cell_value).strip() == "":
-                ws.delete_rows(row)
+            return self.mapping905c[value_905n]
+        return ''
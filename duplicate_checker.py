@@ -3,29 +3,59 @@ Dublettenkontrolle für Swisscovery-Katalog
 Sucht über SRU (Search/Retrieve via URL) nach Dubletten
 """
 
-import requests
-import xml.etree.ElementTree as ET
-from openpyxl import load_workbook
-from openpyxl.styles import PatternFill, Font
+import re
 import urllib.parse
 import time
+from alma_frame import write_atomic
+from rate_controller import AdaptiveRateController
+
+# requests, ElementTree und openpyxl werden erst bei Bedarf importiert,
+# damit main.py schnell startet (siehe README, "Startzeit").
+
+# Gemeinsame HTTP-Session für alle SRU-Anfragen (Verbindungen werden wiederverwendet)
+_sru_session = None
+
+
+def get_sru_session():
+    """
+    Liefert die gemeinsame requests.Session für SRU-Anfragen
+
+    Returns:
+        requests.Session: Session, beim ersten Aufruf erstellt
+    """
+    global _sru_session
+    if _sru_session is None:
+        import requests
+        _sru_session = requests.Session()
+    return _sru_session
 
 
 class DuplicateChecker:
-    def __init__(self, sru_base_url):
+    def __init__(self, sru_base_url, rate_controller=None):
         """
         Initialisiere den DuplicateChecker
 
         Args:
             sru_base_url (str): Base URL für SRU-Suche (z.B. für Swisscovery)
+            rate_controller (AdaptiveRateController, optional): Steuert die Pause zwischen
+                Anfragen anhand von Latenz, Fehlern und HTTP 429
         """
         self.sru_base_url = sru_base_url
         self.timeout = 10
-        self.delay_between_requests = 0.3  # Sekunden zwischen Anfragen
+        self.rate_controller = rate_controller if rate_controller is not None else AdaptiveRateController()
+
+        # Eine kombinierte CQL-Abfrage (ISBN ODER Titel+Autor) statt ISBN- und Titel-Abfrage
+        # nacheinander. Meldet der Server einen Diagnosefehler, wird für den Rest des Laufs
+        # auf die bisherige Abfolge zurückgefallen.
+        self.combined_query_supported = True
+        self.title_query_words = 6         # Maximale Anzahl Titelwörter in der Abfrage
+        self.title_match_threshold = 0.8   # Anteil übereinstimmender Titelwörter für eine Dublette
+        self.request_count = 0             # Anzahl SRU-Anfragen (für die Statistik)
 
         # Namespaces für XML-Parsing
         self.namespaces = {
             'srw': 'http://www.loc.gov/zing/srw/',
+            'diag': 'http://www.loc.gov/zing/srw/diagnostic/',
             'marc': 'http://www.loc.gov/MARC21/slim'
         }
 
@@ -71,7 +101,34 @@ class DuplicateChecker:
 
         return self._execute_sru_search(query)
 
-    def search_combined(self, isbn, title):
+    def search_combined(self, isbn, title, author=''):
+        """
+        Kombinierte Suche mit einer einzigen SRU-Anfrage (ISBN ODER Titel UND Autor).
+        Die gefundenen Records werden lokal bewertet; nur passende zählen als Treffer.
+        Unterstützt der Server die Abfrage nicht, wird search_waterfall verwendet.
+
+        Args:
+            isbn (str): ISBN-Nummer
+            title (str): Buchtitel
+            author (str, optional): Verantwortlichkeitsangabe (24510$c)
+
+        Returns:
+            dict: {'found': bool, 'count': int, 'records': list, 'search_type': str}
+        """
+        if self.combined_query_supported:
+            query = self.build_combined_query(isbn, title, author)
+            if query:
+                result = self._execute_sru_search(query)
+                if not result.get('diagnostic'):
+                    return self._score_result(result, isbn, title, author)
+
+                print(f"[INFO] Kombinierte SRU-Abfrage nicht unterstützt ({result['diagnostic']}), "
+                      f"verwende ISBN-/Titel-Suche.")
+                self.combined_query_supported = False
+
+        return self.search_waterfall(isbn, title)
+
+    def search_waterfall(self, isbn, title):
         """
         Kombinierte Suche (zuerst ISBN, dann Titel als Fallback)
 
@@ -97,6 +154,136 @@ class DuplicateChecker:
 
         return {'found': False, 'count': 0, 'records': [], 'search_type': 'Keine'}
 
+    def build_combined_query(self, isbn, title, author=''):
+        """
+        Erstellt eine CQL-Abfrage: alma.isbn=... or (alma.title all "..." and alma.creator=...)
+
+        Args:
+            isbn (str): ISBN-Nummer
+            title (str): Buchtitel
+            author (str, optional): Verantwortlichkeitsangabe (24510$c)
+
+        Returns:
+            str: CQL-Query oder '' wenn weder ISBN noch Titel vorhanden
+        """
+        clauses = []
+
+        isbn_clean = self._normalize_isbn(isbn)
+        if isbn_clean:
+            clauses.append(f'alma.isbn={isbn_clean}')
+
+        title_words = self._title_words(title)[:self.title_query_words]
+        if title_words:
+            title_clause = f'alma.title all "{" ".join(title_words)}"'
+            surname = self._author_surname(author)
+            if surname:
+                title_clause = f'({title_clause} and alma.creator="{surname}")'
+            clauses.append(title_clause)
+
+        return ' or '.join(clauses)
+
+    def _score_result(self, result, isbn, title, author):
+        """
+        Bewertet die Records einer kombinierten Abfrage lokal. Ein Record ist eine
+        Dublette, wenn eine seiner ISBN übereinstimmt oder Titel und Autor passen.
+
+        Returns:
+            dict: Suchergebnis mit nur den passenden Records
+        """
+        if result.get('error'):
+            result['search_type'] = 'Kombiniert'
+            return result
+
+        isbn_clean = self._isbn13(self._normalize_isbn(isbn))
+        title_words = set(self._title_words(title))
+        surname = self._author_surname(author).lower()
+
+        matches = []
+        search_type = 'Titel'
+        for record in result['records']:
+            if isbn_clean and isbn_clean in self._record_isbns(record):
+                matches.append(record)
+                search_type = 'ISBN'
+                continue
+
+            record_words = set(self._title_words(record.get('title', '')))
+            if not title_words or not record_words:
+                continue
+            overlap = len(title_words & record_words) / min(len(title_words), len(record_words))
+            author_ok = not surname or surname in record.get('author', '').lower()
+            if overlap >= self.title_match_threshold and author_ok:
+                matches.append(record)
+
+        # Bewertet wird nur die erste Seite (maximumRecords). Hat der Server mehr Treffer
+        # und ist keiner davon ein ISBN-Treffer, entscheidet eine reine ISBN-Abfrage.
+        if isbn_clean and search_type != 'ISBN' and result['count'] > len(result['records']):
+            isbn_result = self.search_by_isbn(self._normalize_isbn(isbn))
+            if isbn_result['found'] or (isbn_result.get('error') and not matches):
+                isbn_result['search_type'] = 'ISBN'
+                return isbn_result
+
+        # ISBN-Treffer zuerst, damit 338$a und 020$a aus dem besten Record stammen
+        matches.sort(key=lambda r: isbn_clean not in self._record_isbns(r))
+
+        return {
+            'found': len(matches) > 0,
+            'count': len(matches),
+            'records': matches,
+            'server_count': result['count'],
+            'search_type': search_type if matches else 'Kombiniert'
+        }
+
+    def _record_isbns(self, record):
+        """Alle ISBN eines Records (020$a, z.B. Print und E-Book) als ISBN-13"""
+        isbns = {self._isbn13(self._normalize_isbn(isbn)) for isbn in record.get('isbns', [record.get('isbn', '')])}
+        isbns.discard('')
+        return isbns
+
+    def _normalize_isbn(self, isbn):
+        """Nur Ziffern und X der ersten ISBN (z.B. '978-3-16-148410-0 (pbk.)' -> '9783161484100')"""
+        if not isbn:
+            return ''
+        match = re.search(r'[0-9][0-9\- ]{8,}[0-9Xx]', str(isbn))
+        if not match:
+            return ''
+        return re.sub(r'[^0-9Xx]', '', match.group(0)).upper()
+
+    def _isbn13(self, isbn):
+        """Wandelt eine ISBN-10 in eine ISBN-13 um, damit beide Formen vergleichbar sind"""
+        if len(isbn) != 10:
+            return isbn
+        core = '978' + isbn[:9]
+        checksum = sum(int(d) * (1 if i % 2 == 0 else 3) for i, d in enumerate(core))
+        return core + str((10 - checksum % 10) % 10)
+
+    def _title_words(self, title):
+        """Normalisierte Titelwörter ohne <<Artikel>>, Satzzeichen und Kurzwörter"""
+        if not title:
+            return []
+        title = re.sub(r'<<[^>]*>>', ' ', str(title)).lower()
+        words = re.findall(r'\w+', title)
+        return [w for w in words if len(w) > 2]
+
+    def _author_surname(self, author):
+        """
+        Nachname der ersten Person aus 24510$c, z.B.
+        'Hans Muster ; Eva Meier' -> 'Muster', 'Muster, Hans' -> 'Muster',
+        'Hans Muster, Eva Meier' -> 'Muster'
+        """
+        if not author:
+            return ''
+        author = re.sub(r'\((hrsg|hg|eds?)\.?\)|\b(hrsg|hg|eds?)\.|\b(herausgegeben von|edited by|von|by)\b',
+                        ' ', str(author), flags=re.IGNORECASE)
+        first = re.split(r';| und | and |&|/', author)[0].strip()
+        # "Nachname, Vorname" nur, wenn vor dem Komma ein einzelnes Wort steht;
+        # sonst ist das Komma ein Trenner zwischen Personen ("Vorname Nachname, ...")
+        before_comma = first.split(',')[0].split()
+        if ',' in first and len(before_comma) == 1:
+            surname = before_comma[0]
+        else:
+            surname = before_comma[-1] if before_comma else ''
+        return re.sub(r'[^\w\-]', '', surname)
+
     def _execute_sru_search(self, query):
         """
         Führe SRU-Suche durch
@@ -107,6 +294,9 @@ class DuplicateChecker:
         Returns:
             dict: Suchergebnis
         """
+        import requests
+        import xml.etree.ElementTree as ET
+
         try:
             # URL-Parameter
             params = {
@@ -120,13 +310,33 @@ class DuplicateChecker:
             # URL erstellen
             url = f"{self.sru_base_url}?{urllib.parse.urlencode(params)}"
 
-            # HTTP-Request
-            response = requests.get(url, timeout=self.timeout)
+            # HTTP-Request (Pause vorher bestimmt der Rate-Controller)
+            self.rate_controller.wait()
+            self.request_count += 1
+            started = time.monotonic()
+            response = get_sru_session().get(url, timeout=self.timeout)
+            latency = time.monotonic() - started
+
+            if response.status_code == 429:
+                retry_after = response.headers.get('Retry-After', '')
+                retry_after = float(retry_after) if retry_after.isdigit() else None
+                self.rate_controller.record(latency, 'throttled', retry_after)
+                print(f"[WARNING] SRU-Server drosselt (HTTP 429): {query}")
+                return {'found': False, 'count': 0, 'records': [], 'error': 'HTTP 429', 'retryable': True}
+
             response.raise_for_status()
+            self.rate_controller.record(latency, 'ok')
 
             # XML parsen
             root = ET.fromstring(response.content)
 
+            # SRU-Diagnose (z.B. nicht unterstützter Index oder Operator)
+            diagnostic = root.find('.//diag:diagnostic', self.namespaces)
+            if diagnostic is not None:
+                message = diagnostic.find('diag:message', self.namespaces)
+                return {'found': False, 'count': 0, 'records': [],
+                        'diagnostic': message.text if message is not None else 'SRU-Diagnose'}
+
             # Anzahl der Treffer
             number_of_records_elem = root.find('.//srw:numberOfRecords', self.namespaces)
             number_of_records = int(number_of_records_elem.text) if number_of_records_elem is not None else 0
@@ -140,9 +350,6 @@ class DuplicateChecker:
                 if record_data:
                     records.append(record_data)
 
-            # Delay für nächste Anfrage
-            time.sleep(self.delay_between_requests)
-
             return {
                 'found': number_of_records > 0,
                 'count': number_of_records,
@@ -150,11 +357,16 @@ class DuplicateChecker:
             }
 
         except requests.exceptions.Timeout:
+            self.rate_controller.record(self.timeout, 'timeout')
             print(f"[WARNING] Timeout bei SRU-Suche: {query}")
-            return {'found': False, 'count': 0, 'records': [], 'error': 'Timeout'}
+            return {'found': False, 'count': 0, 'records': [], 'error': 'Timeout', 'retryable': True}
         except requests.exceptions.RequestException as e:
+            # Verbindungsfehler und Serverfehler (5xx) werden am Ende des Laufs wiederholt
+            status = e.response.status_code if e.response is not None else None
+            retryable = isinstance(e, requests.exceptions.ConnectionError) or (status is not None and status >= 500)
+            self.rate_controller.record(None, 'error')
             print(f"[WARNING] Fehler bei SRU-Suche: {e}")
-            return {'found': False, 'count': 0, 'records': [], 'error': str(e)}
+            return {'found': False, 'count': 0, 'records': [], 'error': str(e), 'retryable': retryable}
         except Exception as e:
             print(f"[ERROR] Unerwarteter Fehler bei SRU-Suche: {e}")
             return {'found': False, 'count': 0, 'records': [], 'error': str(e)}
@@ -187,9 +399,10 @@ class DuplicateChecker:
                 author_field = marc_record.find('.//marc:datafield[@tag="700"]/marc:subfield[@code="a"]', self.namespaces)
             record_data['author'] = author_field.text.strip() if author_field is not None else ''
 
-            # ISBN (020$a)
-            isbn_field = marc_record.find('.//marc:datafield[@tag="020"]/marc:subfield[@code="a"]', self.namespaces)
-            record_data['isbn'] = isbn_field.text.strip() if isbn_field is not None else ''
+            # ISBN (020$a): alle Wiederholungen (Print, Paperback, E-Book), die erste für die Anzeige
+            isbn_fields = marc_record.findall('.//marc:datafield[@tag="020"]/marc:subfield[@code="a"]', self.namespaces)
+            record_data['isbns'] = [field.text.strip() for field in isbn_fields if field.text]
+            record_data['isbn'] = record_data['isbns'][0] if record_data['isbns'] else ''
 
             # Verlag (264$b)
             publisher_field = marc_record.find('.//marc:datafield[@tag="264"]/marc:subfield[@code="b"]', self.namespaces)
@@ -220,6 +433,25 @@ class DuplicateChecker:
         Returns:
             dict: Statistik {'total': int, 'duplicates': int, 'errors': int}
         """
+        for event, data in self.iter_duplicate_check(excel_path, output_path):
+            if event == 'done':
+                return data
+
+    def iter_duplicate_check(self, excel_path, output_path=None):
+        """
+        Prüfe Excel-Datei auf Dubletten und liefere jedes Ergebnis, sobald die
+        Abfrage abgeschlossen ist. Die Datei wird am Ende gespeichert.
+
+        Args:
+            excel_path (str): Pfad zur Excel-Datei
+            output_path (str, optional): Pfad für Ausgabedatei (Standard: überschreibt Original)
+
+        Yields:
+            tuple: ('row', dict) pro geprüfter Zeile, zum Schluss ('done', Statistik)
+        """
+        from openpyxl import load_workbook
+        from openpyxl.styles import PatternFill, Font
+
         if output_path is None:
             output_path = excel_path
 
@@ -263,16 +495,39 @@ class DuplicateChecker:
         yellow_fill = PatternFill(start_color='FFFF00', end_color='FFFF00', fill_type='solid')
         red_font = Font(color='FF0000', bold=True)
 
+        total_rows = sheet.max_row - 1
+        start_time = time.monotonic()
+        columns = (duplicate_col, count_col, carrier_col, isbn_sru_col)
+        styles = (yellow_fill, red_font)
+
+        # Zeilen mit vorübergehenden Fehlern (Timeout, HTTP 429, Verbindungsfehler)
+        # werden am Ende des Laufs ein zweites Mal abgefragt statt als FEHLER markiert
+        deferred = []
+
+        def row_event(row_result, row_idx, isbn, title):
+            elapsed = time.monotonic() - start_time
+            row_result.update(
+                row=row_idx,
+                isbn=str(isbn) if isbn else '',
+                title=str(title) if title else '',
+                processed=stats['total'],
+                total_rows=total_rows,
+                rows_per_second=round(stats['total'] / elapsed, 2) if elapsed > 0 else None
+            )
+            return 'row', row_result
+
         # Durch Zeilen iterieren (ab Zeile 2, da Zeile 1 = Header)
         for row_idx in range(2, sheet.max_row + 1):
             stats['total'] += 1
 
-            try:
-                # ISBN und Titel aus der Excel-Datei holen
-                # Annahme: Spalte mit ISBN ist vorhanden (muss angepasst werden)
-                isbn = None
-                title = None
+            # ISBN und Titel aus der Excel-Datei holen
+            # Annahme: Spalte mit ISBN ist vorhanden (muss angepasst werden)
+            isbn = None
+            title = None
+            author = None
+            row_result = None
 
+            try:
                 # Suche nach ISBN-Spalte (020$a)
                 for col_idx in range(1, max_col + 1):
                     header = str(sheet.cell(1, col_idx).value).strip()
@@ -287,46 +542,111 @@ class DuplicateChecker:
                         title = sheet.cell(row_idx, col_idx).value
                         break
 
+                # Suche nach Autor-Spalte (24510$c)
+                for col_idx in range(1, max_col + 1):
+                    header = str(sheet.cell(1, col_idx).value).strip()
+                    if '24510$c' in header or 'AUTOR' in header.upper():
+                        author = sheet.cell(row_idx, col_idx).value
+                        break
+
                 # Nur suchen, wenn ISBN oder Titel vorhanden
                 if isbn or title:
                     stats['checked'] += 1
-                    result = self.search_combined(str(isbn) if isbn else '', str(title) if title else '')
-
-                    if result.get('error'):
-                        stats['errors'] += 1
-                        sheet.cell(row_idx, duplicate_col, 'FEHLER')
-                        sheet.cell(row_idx, count_col, result.get('error', ''))
-                    elif result['found']:
-                        stats['duplicates'] += 1
-                        sheet.cell(row_idx, duplicate_col, 'JA')
-                        sheet.cell(row_idx, duplicate_col).fill = yellow_fill
-                        sheet.cell(row_idx, duplicate_col).font = red_font
-                        sheet.cell(row_idx, count_col, result['count'])
-                        sheet.cell(row_idx, count_col).fill = yellow_fill
-                        # Zusatz: 338$a und 020$a aus dem ersten Treffer in eigene Spalten schreiben
-                        if result['records']:
-                            first_rec = result['records'][0]
-
-                            # 338$a (carrier)
-                            carrier = first_rec.get('carrier', '')
-                            sheet.cell(row_idx, carrier_col, carrier)
-
-                            # 020$a (ISBN aus SRU)
-                            isbn_sru = first_rec.get('isbn', '')
-                            sheet.cell(row_idx, isbn_sru_col, isbn_sru)
+                    result = self.search_combined(str(isbn) if isbn else '', str(title) if title else '',
+                                                  str(author) if author else '')
+
+                    if result.get('retryable'):
+                        deferred.append((row_idx, isbn, title, author))
                     else:
-                        sheet.cell(row_idx, duplicate_col, 'NEIN')
-                        sheet.cell(row_idx, count_col, 0)
+                        row_result = self._write_result(sheet, row_idx, result, stats, columns, styles)
+
+            except Exception as e:
+                print(f"[ERROR] Fehler in Zeile {row_idx}: {e}")
+                stats['errors'] += 1
+                sheet.cell(row_idx, duplicate_col, 'FEHLER')
+                row_result = {'status': 'FEHLER', 'count': 0, 'carrier': '', 'isbn_sru': '',
+                              'search_type': '', 'error': str(e)}
+
+            if row_result is not None:
+                yield row_event(row_result, row_idx, isbn, title)
 
+        # Zweiter Versuch für zurückgestellte Zeilen, mit der inzwischen angepassten Rate
+        stats['retried'] = len(deferred)
+        stats['recovered'] = 0
+        for row_idx, isbn, title, author in deferred:
+            try:
+                result = self.search_combined(str(isbn) if isbn else '', str(title) if title else '',
+                                              str(author) if author else '')
+                if not result.get('error'):
+                    stats['recovered'] += 1
+                row_result = self._write_result(sheet, row_idx, result, stats, columns, styles)
             except Exception as e:
                 print(f"[ERROR] Fehler in Zeile {row_idx}: {e}")
                 stats['errors'] += 1
                 sheet.cell(row_idx, duplicate_col, 'FEHLER')
+                row_result = {'status': 'FEHLER', 'count': 0, 'carrier': '', 'isbn_sru': '',
+                              'search_type': '', 'error': str(e)}
+            yield row_event(row_result, row_idx, isbn, title)
+
+        # Datei speichern (über eine temporäre Datei, gleichzeitige Leser sehen nie eine halbe Datei)
+        write_atomic(output_path, workbook.save)
+
+        stats['sru_requests'] = self.request_count
+        stats['rate_control'] = self.rate_controller.summary()
+        yield 'done', stats
 
-        # Datei speichern
-        workbook.save(output_path)
+    def _write_result(self, sheet, row_idx, result, stats, columns, styles):
+        """
+        Schreibt das Suchergebnis einer Zeile in die Dubletten-Spalten
+
+        Args:
+            sheet: Arbeitsblatt
+            row_idx (int): Zeilennummer
+            result (dict): Ergebnis von search_combined
+            stats (dict): Statistik, wird fortgeschrieben
+            columns (tuple): Spalten für Dublette, Anzahl Treffer, 338$a und 020$a
+            styles (tuple): Füllung und Schrift für Dubletten
 
-        return stats
+        Returns:
+            dict: Ergebnis der Zeile für den Stream
+        """
+        duplicate_col, count_col, carrier_col, isbn_sru_col = columns
+        yellow_fill, red_font = styles
+
+        row_result = {'status': 'NEIN', 'count': 0, 'carrier': '', 'isbn_sru': '',
+                      'search_type': result.get('search_type', '')}
+
+        if result.get('error'):
+            stats['errors'] += 1
+            sheet.cell(row_idx, duplicate_col, 'FEHLER')
+            sheet.cell(row_idx, count_col, result.get('error', ''))
+            row_result.update(status='FEHLER', error=result.get('error', ''))
+        elif result['found']:
+            stats['duplicates'] += 1
+            sheet.cell(row_idx, duplicate_col, 'JA')
+            sheet.cell(row_idx, duplicate_col).fill = yellow_fill
+            sheet.cell(row_idx, duplicate_col).font = red_font
+            sheet.cell(row_idx, count_col, result['count'])
+            sheet.cell(row_idx, count_col).fill = yellow_fill
+            row_result.update(status='JA', count=result['count'])
+            # Zusatz: 338$a und 020$a aus dem ersten Treffer in eigene Spalten schreiben
+            if result['records']:
+                first_rec = result['records'][0]
+
+                # 338$a (carrier)
+                carrier = first_rec.get('carrier', '')
+                sheet.cell(row_idx, carrier_col, carrier)
+
+                # 020$a (ISBN aus SRU)
+                isbn_sru = first_rec.get('isbn', '')
+                sheet.cell(row_idx, isbn_sru_col, isbn_sru)
+
+                row_result.update(carrier=carrier, isbn_sru=isbn_sru)
+        else:
+            sheet.cell(row_idx, duplicate_col, 'NEIN')
+            sheet.cell(row_idx, count_col, 0)
+
+        return row_result
 
 
 def check_duplicates_in_file(excel_path, sru_url, output_path=None):
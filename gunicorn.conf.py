@@ -0,0 +1,18 @@
+"""
+gunicorn-Konfiguration
+
+Optionales Vorladen: mit PRELOAD_APP=1 wird die App einmal im Master geladen
+und main.warm_caches() aufgerufen. Die geforkten Worker teilen sich dann
+pandas/openpyxl, die CSV-Mappings und die SRU-Session.
+"""
+
+import os
+
+preload_app = os.environ.get("PRELOAD_APP", "0") == "1"
+
+
+def on_starting(server):
+    if preload_app:
+        from main import warm_caches
+        warm_caches()
+        server.log.info("Mappings und SRU-Session vorgeladen.")
@@ -0,0 +1,282 @@
+"""
+Lasttest für die Flask-App mit mehreren gleichzeitigen Benutzern
+Jeder simulierte Benutzer lädt Dateien hoch, verarbeitet sie, führt die Dublettenkontrolle
+gegen einen lokalen SRU-Stub durch und lädt das Ergebnis herunter.
+
+Beispiele:
+    python loadtest.py --users 5 --iterations 3
+    python loadtest.py --url http://localhost:8000 --users 10   (laufende Instanz, z.B. gunicorn)
+"""
+
+import argparse
+import hashlib
+import http.server
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from auth import USERNAME, PASSWORD
+
+
+SRU_RECORD = (
+    '<srw:record><srw:recordData><record xmlns="http://www.loc.gov/MARC21/slim">'
+    '<datafield tag="245"><subfield code="a">{title}</subfield></datafield>'
+    '<datafield tag="100"><subfield code="a">{author}</subfield></datafield>'
+    '{isbn_field}'
+    '<datafield tag="338"><subfield code="a">Band</subfield></datafield>'
+    '</record></srw:recordData></srw:record>'
+)
+SRU_ISBN_FIELD = '<datafield tag="020"><subfield code="a">{isbn}</subfield></datafield>'
+
+
+class SRUStubHandler(http.server.BaseHTTPRequestHandler):
+    """Antwortet auf SRU-Anfragen mit festen MARC-Records nach einer einstellbaren Latenz"""
+
+    latency = 0.05      # Sekunden pro Antwort
+    hit_rate = 0.2      # Anteil der Abfragen mit Treffer
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query).get('query', [''])[0]
+        time.sleep(self.latency)
+
+        # Deterministisch: gleiche Abfrage, gleiches Ergebnis
+        bucket = int(hashlib.md5(query.encode('utf-8')).hexdigest(), 16) % 100
+        hit = bucket < self.hit_rate * 100
+        # Titel-Treffer ohne ISBN: 020 weglassen statt ein leeres Unterfeld zu liefern
+        isbn = query.split('alma.isbn=')[1].split()[0] if 'alma.isbn=' in query else ''
+        isbn_field = SRU_ISBN_FIELD.format(isbn=isbn) if isbn else ''
+        records = SRU_RECORD.format(title='Stub-Titel', author='Stub, Autor', isbn_field=isbn_field) if hit else ''
+
+        body = (
+            '<srw:searchRetrieveResponse xmlns:srw="http://www.loc.gov/zing/srw/">'
+            f'<srw:numberOfRecords>{1 if hit else 0}</srw:numberOfRecords>'
+            f'<srw:records>{records}</srw:records>'
+            '</srw:searchRetrieveResponse>'
+        ).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_sru_stub(latency, hit_rate):
+    """
+    Startet den SRU-Stub in einem Hintergrund-Thread
+
+    Returns:
+        tuple: (Server, SRU-URL)
+    """
+    handler = type('ConfiguredSRUStub', (SRUStubHandler,), {'latency': latency, 'hit_rate': hit_rate})
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/sru"
+
+
+def start_local_app(workdir):
+    """
+    Startet main.app in einem Hintergrund-Thread. Uploads, Ausgabe und Profile
+    werden in workdir umgeleitet, damit der Lasttest das Projektverzeichnis nicht verändert.
+
+    Returns:
+        tuple: (Server, Basis-URL)
+    """
+    from werkzeug.serving import make_server
+
+    # DataProcessor legt die Ausgabe relativ zum Arbeitsverzeichnis ab
+    os.chdir(workdir)
+
+    import main
+    main.paths["input_dir"] = os.path.join(workdir, 'uploads')
+    main.paths["output_file"] = os.path.join(workdir, 'output', 'output.xlsx')
+    main.paths["profiles_dir"] = os.path.join(workdir, 'profiles')
+    main.profiler.profiles_dir = main.paths["profiles_dir"]
+    main.paths["alma_frame"] = os.path.join(workdir, 'output', 'alma_frame.arrow')
+    main.paths["output_csv"] = os.path.join(workdir, 'output', 'output.csv')
+    main.paths["upload_index"] = os.path.join(workdir, 'output', 'upload_index.json')
+    main.ensure_directory_exists(main.paths["input_dir"])
+    main.ensure_directory_exists(os.path.dirname(main.paths["output_file"]))
+
+    # Zugriffslog von werkzeug unterdrücken, damit die Auswertung lesbar bleibt
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    server = make_server('127.0.0.1', 0, main.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def make_order_file(rows, seed):
+    """
+    Erstellt eine Bestellliste im Format der Fachreferate
+
+    Returns:
+        bytes: Inhalt der .xlsx-Datei
+    """
+    from openpyxl import Workbook
+
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["Bibliothek", "ISBN", "Autor(en)", "Titel", "Verlag", "Preis Euro", "Etat",
+               "Auflage/Ausgabe", "Interne Bemerkung"])
+    for i in range(rows):
+        ws.append([["E01", "E03", "E05"][i % 3], f"978316{seed % 1000:03d}{i:04d}", f"Autor{i} Muster",
+                   f"Die Geschichte der Lasttests Band {seed}-{i}", "Springer Verlag", 19.9,
+                   "Etat", "", ""])
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+class LoadTestResults:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.error_samples = defaultdict(list)
+
+    def record(self, route, latency, ok, detail=None):
+        with self.lock:
+            self.latencies[route].append(latency)
+            if not ok:
+                self.errors[route] += 1
+                if detail and len(self.error_samples[route]) < 3:
+                    self.error_samples[route].append(detail)
+
+    def summary(self, duration):
+        """
+        Kennzahlen pro Route
+
+        Returns:
+            dict: Route -> {'requests', 'errors', 'error_rate', 'throughput', 'p50', 'p95', 'p99'}
+        """
+        result = {}
+        for route, latencies in self.latencies.items():
+            ordered = sorted(latencies)
+            result[route] = {
+                'requests': len(ordered),
+                'errors': self.errors[route],
+                'error_rate': round(self.errors[route] / len(ordered), 3),
+                'throughput': round(len(ordered) / duration, 2),
+                'p50': round(percentile(ordered, 50), 3),
+                'p95': round(percentile(ordered, 95), 3),
+                'p99': round(percentile(ordered, 99), 3),
+                'error_samples': self.error_samples[route]
+            }
+        return result
+
+
+def percentile(ordered, pct):
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def simulate_user(user, base_url, sru_url, args, results):
+    """Ein Benutzer durchläuft den Ablauf Upload -> Verarbeitung -> Dubletten (POST und Stream) -> Download"""
+    import requests
+
+    session = requests.Session()
+    session.auth = (USERNAME, PASSWORD)
+
+    def call(route, method, path, expect=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = session.request(method, base_url + path, timeout=args.timeout, **kwargs)
+            # expect: Text, der in der Antwort vorkommen muss (z.B. Abschluss-Ereignis des Streams)
+            ok = response.status_code < 400 and (expect is None or expect in response.text)
+            detail = None if ok else f"HTTP {response.status_code}: {response.text[-200:]}"
+        except requests.RequestException as e:
+            response, ok, detail = None, False, str(e)
+        results.record(route, time.perf_counter() - started, ok, detail)
+        return response
+
+    for iteration in range(args.iterations):
+        names = [f"loadtest_u{user}_i{iteration}_f{k}.xlsx" for k in range(args.files)]
+        files = [('file', (name, make_order_file(args.rows, user * 100 + iteration * 10 + k),
+                           'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'))
+                 for k, name in enumerate(names)]
+
+        call('POST /', 'POST', '/', files=files, allow_redirects=False)
+        call('GET /get_uploaded_files', 'GET', '/get_uploaded_files')
+        call('POST /process', 'POST', '/process')
+        call('POST /check_duplicates', 'POST', '/check_duplicates', json={'sru_url': sru_url})
+        call('GET /check_duplicates_stream', 'GET', '/check_duplicates_stream', expect='event: done',
+             params={'sru_url': sru_url})
+        call('GET /download', 'GET', '/download')
+
+        for name in names:
+            call('DELETE /delete_file', 'DELETE', f"/delete_file/{name}")
+
+
+def print_summary(summary, duration, args):
+    print(f"\nLasttest: {args.users} Benutzer x {args.iterations} Durchläufe, "
+          f"{args.files} Datei(en) à {args.rows} Zeilen, Dauer {duration:.1f}s\n")
+    header = f"{'Route':<32}{'Anfr.':>7}{'Fehler':>8}{'Rate/s':>9}{'p50 s':>9}{'p95 s':>9}{'p99 s':>9}"
+    print(header)
+    print('-' * len(header))
+    for route, stats in summary.items():
+        print(f"{route:<32}{stats['requests']:>7}{stats['errors']:>8}{stats['throughput']:>9}"
+              f"{stats['p50']:>9}{stats['p95']:>9}{stats['p99']:>9}")
+    for route, stats in summary.items():
+        for sample in stats['error_samples']:
+            print(f"[FEHLER] {route}: {sample}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lasttest mit gleichzeitigen Benutzern und SRU-Stub")
+    parser.add_argument('--url', help="Basis-URL einer laufenden Instanz (Standard: App lokal starten)")
+    parser.add_argument('--users', type=int, default=5, help="Anzahl gleichzeitiger Benutzer")
+    parser.add_argument('--iterations', type=int, default=2, help="Durchläufe pro Benutzer")
+    parser.add_argument('--files', type=int, default=2, help="Dateien pro Upload")
+    parser.add_argument('--rows', type=int, default=10, help="Zeilen pro Datei")
+    parser.add_argument('--sru-latency', type=float, default=0.05, help="Antwortzeit des SRU-Stubs in Sekunden")
+    parser.add_argument('--sru-hit-rate', type=float, default=0.2, help="Anteil Dubletten im SRU-Stub")
+    parser.add_argument('--timeout', type=float, default=300, help="Timeout pro Anfrage in Sekunden")
+    parser.add_argument('--json', help="Ergebnis zusätzlich als JSON in diese Datei schreiben")
+    args = parser.parse_args()
+
+    sru_server, sru_url = start_sru_stub(args.sru_latency, args.sru_hit_rate)
+
+    app_server = None
+    workdir = None
+    base_url = args.url.rstrip('/') if args.url else None
+    if base_url is None:
+        workdir = tempfile.mkdtemp(prefix='bestellung-loadtest-')
+        app_server, base_url = start_local_app(workdir)
+
+    results = LoadTestResults()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        futures = [pool.submit(simulate_user, user, base_url, sru_url, args, results)
+                   for user in range(args.users)]
+        for future in futures:
+            future.result()
+    duration = time.perf_counter() - started
+
+    summary = results.summary(duration)
+    print_summary(summary, duration, args)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump({'duration': duration, 'args': vars(args), 'routes': summary}, file, indent=2)
+
+    sru_server.shutdown()
+    if app_server is not None:
+        app_server.shutdown()
+        print(f"\nArbeitsverzeichnis des Lasttests: {workdir}")
+
+
+if __name__ == "__main__":
+    main()
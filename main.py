@@ -1,13 +1,23 @@
-from flask import Flask, request, render_template, send_file, redirect, url_for, flash, jsonify
+from flask import Flask, request, render_template, send_file, send_from_directory, redirect, url_for, flash, jsonify, Response, stream_with_context, after_this_request
 from flask_httpauth import HTTPBasicAuth
 from auth import USERNAME, PASSWORD  # Import the credentials
 from datetime import datetime
 from paths import PathManager
-from data_processor import DataProcessor
-from duplicate_checker import DuplicateChecker
+from data_processor import DataProcessor, COLUMNS_MAPPING
+from duplicate_checker import DuplicateChecker, get_sru_session
+from rate_controller import AdaptiveRateController
+from profiling import RequestProfiler
+from csv_loader import CSVLoader
+from processing_report import ProcessingReport
+from alma_frame import AlmaFrame
+from upload_index import UploadIndex
 import os
 import time
 import csv
+import json
+import queue
+import threading
+import functools
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key'
@@ -35,6 +45,23 @@ paths = path_manager.get_paths()
 # SRU Base URL für Swisscovery (wird später vom User konfigurierbar sein)
 SWISSCOVERY_SRU_URL = "https://slsp-eth.alma.exlibrisgroup.com/view/sru/41SLSP_ETH"  # Wird vom Benutzer gesetzt
 
+# Profiling: für alle Requests per Umgebungsvariable, sonst einzeln per Header "X-Profile: 1"
+# oder ?profile=1 (für EventSource, das keine Header setzen kann). Verfügbar für jeden angemeldeten Benutzer.
+PROFILING_ENABLED = os.environ.get("PROFILE_REQUESTS", "0") == "1"
+profiler = RequestProfiler(paths["profiles_dir"])
+
+# Metadaten der hochgeladenen Dateien (für /get_uploaded_files, ohne Arbeitsmappen zu öffnen)
+upload_index = UploadIndex(paths)
+
+# Grenzen für die adaptive SRU-Anfragerate (Pause zwischen Anfragen in Sekunden)
+SRU_MIN_DELAY = 0.05
+SRU_MAX_DELAY = 5.0
+
+# Chunk-Modus für grosse Bestelllisten: ab dieser Dateigrösse wird blockweise verarbeitet
+CHUNKED_PROCESSING_THRESHOLD_MB = 5
+CHUNK_SIZE = 1000
+MEMORY_WARNING_MB = 512  # Nur Warnschwelle (Log und Report), begrenzt den Speicher nicht
+
 def ensure_directory_exists(directory, retries=5, delay=1):
     """Erstelle das Verzeichnis, wenn es nicht existiert, mit wiederholter Prüfung."""
     for _ in range(retries):
@@ -49,6 +76,89 @@ def ensure_directory_exists(directory, retries=5, delay=1):
         time.sleep(delay)
     raise Exception(f"[ERROR] Das Verzeichnis '{directory}' konnte nach mehreren Versuchen nicht erstellt werden.")
 
+def create_duplicate_checker(sru_url):
+    """DuplicateChecker mit adaptiver Anfragerate innerhalb der konfigurierten Grenzen"""
+    return DuplicateChecker(sru_url, AdaptiveRateController(min_delay=SRU_MIN_DELAY, max_delay=SRU_MAX_DELAY))
+
+def profiling_requested():
+    """Profiling für den aktuellen Request aktiv (Umgebungsvariable, Header oder Query-Parameter)?"""
+    return PROFILING_ENABLED or request.headers.get('X-Profile') == '1' or request.args.get('profile') == '1'
+
+def profiled(view):
+    """Führt die Route unter cProfile aus, wenn Profiling aktiviert oder angefordert ist"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not profiling_requested():
+            return view(*args, **kwargs)
+
+        result, filename = profiler.run(request.endpoint, view, *args, **kwargs)
+        if filename is None:
+            return result
+
+        @after_this_request
+        def add_profile_header(response):
+            response.headers['X-Profile-File'] = filename
+            return response
+
+        return result
+    return wrapper
+
+def create_data_processor(report=None):
+    """DataProcessor für das aktuelle Bestelljahr"""
+    # Ab November wird das nächste Jahr verwendet im Feld 245$c
+    now = datetime.now()
+    year = now.year + 1 if now.month >= 11 else now.year
+    return DataProcessor(paths, year, report)
+
+def attach_duplicate_results(results_by_row):
+    """Ergebnisse der Dublettenkontrolle in den Alma-Frame übernehmen (falls vorhanden)"""
+    # Der Frame ist nur ein Zwischenspeicher: ein Fehler darf die (bereits gespeicherte) Dublettenkontrolle nicht scheitern lassen
+    frame = AlmaFrame(paths["alma_frame"])
+    try:
+        if frame.exists():
+            frame.attach_duplicate_results(results_by_row)
+    except Exception as e:
+        print(f"[WARNING] Ergebnisse konnten nicht in den Alma-Frame übernommen werden: {e}")
+
+def run_duplicate_check(checker, output_file_path, events):
+    """
+    Führt die Dublettenkontrolle vollständig aus und legt jedes Ereignis in die Queue.
+    Läuft in einem eigenen Thread, damit die Kontrolle auch zu Ende geführt und
+    gespeichert wird, wenn der Client die Verbindung trennt.
+
+    Args:
+        checker (DuplicateChecker): Konfigurierter Checker
+        output_file_path (str): Verarbeitete Excel-Datei
+        events (queue.Queue): Empfängt (Ereignis, Daten)
+    """
+    try:
+        # 'row' pro Zeile, zum Schluss 'done' mit der Statistik (Datei ist dann gespeichert)
+        results_by_row = {}
+        for event, data in checker.iter_duplicate_check(output_file_path):
+            if event == 'row':
+                results_by_row[data['row']] = data
+            else:
+                attach_duplicate_results(results_by_row)
+            events.put((event, data))
+    except Exception as e:
+        events.put(('failed', {"error": f"Fehler bei der Dublettenkontrolle: {str(e)}"}))
+
+def flash_report(report):
+    """Gibt die gesammelten Meldungen eines ProcessingReport als Flash-Meldungen aus."""
+    for message, category in report.flash_messages():
+        flash(message, category)
+
+def warm_caches():
+    """
+    Lädt pandas/openpyxl, die CSV-Mappings und die SRU-Session vor.
+    Wird vom gunicorn-Master vor dem Forken aufgerufen (siehe gunicorn.conf.py),
+    damit alle Worker den vorgewärmten Zustand teilen.
+    """
+    import pandas  # noqa: F401
+    import openpyxl  # noqa: F401
+    CSVLoader(paths).load_csv_mappings()
+    get_sru_session()
+
 # Sicherstellen, dass das Upload-Verzeichnis beim Start der Anwendung existiert
 ensure_directory_exists(paths["input_dir"])
 ensure_directory_exists(os.path.dirname(paths["output_file"]))
@@ -77,6 +187,7 @@ def upload_file():
 
                     if os.path.exists(upload_path) and os.path.getsize(upload_path) > 0:
                         saved_files.append(upload_path)
+                        upload_index.add(upload_path, COLUMNS_MAPPING)
                         flash(f"Datei {file.filename} wurde erfolgreich hochgeladen.", 'success')
                     else:
                         flash(f"Fehler: Datei {file.filename} wurde nicht korrekt hochgeladen.", 'error')
@@ -94,27 +205,34 @@ def upload_file():
     return render_template("index.html")
 
 @app.route("/process", methods=["POST"])
+@profiled
 def process_files():
     ensure_directory_exists(paths["input_dir"])  # Sicherstellen, dass das Verzeichnis existiert
 
+    report = ProcessingReport()
     try:
-        # Ab November wird das nächste Jahr verwendet im Feld 245$c
-        now = datetime.now()
-        year = now.year + 1 if now.month >= 11 else now.year
-        data_processor = DataProcessor(paths, year)
+        data_processor = create_data_processor(report)
         input_files = os.listdir(paths["input_dir"])
         input_file_paths = [os.path.join(paths["input_dir"], file) for file in input_files if file.endswith('.xlsx')]
 
         if not input_file_paths:
             return jsonify({"error": "Keine gültigen Dateien zum Verarbeiten gefunden."}), 400
 
-        data_processor.process_files(input_file_paths)
+        # Grosse Dateien (oder auf Wunsch via ?chunked=1) blockweise verarbeiten
+        largest_file_mb = max(os.path.getsize(path) for path in input_file_paths) / (1024 * 1024)
+        if request.args.get('chunked') == '1' or largest_file_mb > CHUNKED_PROCESSING_THRESHOLD_MB:
+            data_processor.process_files_chunked(input_file_paths, CHUNK_SIZE, MEMORY_WARNING_MB)
+        else:
+            data_processor.process_files(input_file_paths)
+        flash_report(report)
 
-        return jsonify({"message": "Bestellliste wurde erfolgreich erstellt."}), 200
+        return jsonify({"message": "Bestellliste wurde erfolgreich erstellt.", "report": report.to_dict()}), 200
     except Exception as e:
+        flash_report(report)
         return jsonify({"error": f"Fehler bei der Verarbeitung: {str(e)}"}), 500
 
 @app.route("/check_duplicates", methods=["POST"])
+@profiled
 def check_duplicates():
     """Führt Dublettenkontrolle auf der verarbeiteten Excel-Datei durch"""
     try:
@@ -131,8 +249,14 @@ def check_duplicates():
             return jsonify({"error": "Keine verarbeitete Datei gefunden. Bitte erst verarbeiten."}), 400
 
         # Dublettenkontrolle durchführen
-        checker = DuplicateChecker(sru_url)
-        stats = checker.check_excel_file_for_duplicates(output_file_path)
+        checker = create_duplicate_checker(sru_url)
+        results_by_row = {}
+        for event, event_data in checker.iter_duplicate_check(output_file_path):
+            if event == 'row':
+                results_by_row[event_data['row']] = event_data
+            else:
+                stats = event_data
+        attach_duplicate_results(results_by_row)
 
         return jsonify({
             "message": "Dublettenkontrolle abgeschlossen.",
@@ -142,6 +266,48 @@ def check_duplicates():
     except Exception as e:
         return jsonify({"error": f"Fehler bei der Dublettenkontrolle: {str(e)}"}), 500
 
+@app.route("/check_duplicates_stream")
+def check_duplicates_stream():
+    """Dublettenkontrolle als Server-Sent Events: ein Ereignis pro geprüfter Zeile"""
+    sru_url = request.args.get('sru_url', SWISSCOVERY_SRU_URL)
+
+    if not sru_url:
+        return jsonify({"error": "SRU-URL fehlt. Bitte konfigurieren Sie die Swisscovery-URL."}), 400
+
+    output_file_path = paths["output_file"]
+
+    if not os.path.exists(output_file_path):
+        return jsonify({"error": "Keine verarbeitete Datei gefunden. Bitte erst verarbeiten."}), 400
+
+    checker = create_duplicate_checker(sru_url)
+
+    # Die Kontrolle läuft unabhängig von der Antwort; der Stream gibt nur ihren Fortschritt weiter
+    events = queue.Queue()
+    profile_name = request.endpoint if profiling_requested() else None
+
+    def run():
+        # Jeder Fehler (auch beim Profiling) muss als Ereignis ankommen, sonst wartet der Stream ewig
+        try:
+            if profile_name:
+                # Profiliert wird der Thread der Kontrolle; das Profil erscheint unter /profiles
+                profiler.run(profile_name, run_duplicate_check, checker, output_file_path, events)
+            else:
+                run_duplicate_check(checker, output_file_path, events)
+        except Exception as e:
+            events.put(('failed', {"error": f"Fehler bei der Dublettenkontrolle: {str(e)}"}))
+
+    threading.Thread(target=run, daemon=True).start()
+
+    def generate():
+        while True:
+            event, data = events.get()
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+            if event != 'row':
+                break
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route("/download")
 def download_file():
     output_file_path = paths["output_file"]
@@ -151,13 +317,44 @@ def download_file():
         flash("Die Ergebnisdatei existiert nicht. Bitte laden Sie eine Datei hoch und führen Sie die Verarbeitung durch.", 'error')
         return redirect(url_for('upload_file'))
 
+@app.route("/export")
+def export_file():
+    """Export der verarbeiteten Liste aus dem Alma-Frame (?format=xlsx oder csv), ohne neu zu verarbeiten"""
+    export_format = request.args.get('format', 'xlsx')
+    if export_format not in ('xlsx', 'csv'):
+        return jsonify({"error": f"Unbekanntes Format: {export_format}"}), 400
+
+    frame = AlmaFrame(paths["alma_frame"])
+    if not frame.exists():
+        return jsonify({"error": "Keine zwischengespeicherten Daten gefunden. Bitte erst verarbeiten."}), 400
+
+    try:
+        if export_format == 'csv':
+            export_path = paths["output_csv"]
+            frame.export_csv(export_path)
+        else:
+            export_path = paths["output_file"]
+            frame.export_xlsx(export_path)
+        return send_file(export_path, as_attachment=True)
+    except Exception as e:
+        return jsonify({"error": f"Fehler beim Export: {str(e)}"}), 500
+
+@app.route("/profiles")
+def list_profiles():
+    """Liste der zuletzt gespeicherten Profile"""
+    return jsonify(profiler.list_profiles())
+
+@app.route("/profiles/<filename>")
+def download_profile(filename):
+    """Download eines Profils im pstats-Format"""
+    return send_from_directory(paths["profiles_dir"], filename, as_attachment=True)
+
 @app.route("/get_uploaded_files")
 def get_uploaded_files():
     ensure_directory_exists(paths["input_dir"])  # Sicherstellen, dass das Verzeichnis existiert
 
     try:
-        uploaded_files = os.listdir(paths["input_dir"])
-        return jsonify(uploaded_files)
+        return jsonify(upload_index.list_files())
     except Exception as e:
         return jsonify({"error": str(e)})
 
@@ -167,6 +364,7 @@ def delete_file(filename):
         file_path = os.path.join(paths["input_dir"], filename)
         if os.path.exists(file_path):
             os.remove(file_path)
+            upload_index.remove(filename)
             return f"Datei {filename} wurde erfolgreich gelöscht.", 200
         else:
             return f"Datei {filename} wurde nicht gefunden.", 404
@@ -181,6 +379,7 @@ def clear_files():
             if os.path.isfile(file_path):
                 os.remove(file_path)
 
+        upload_index.clear()
         ensure_directory_exists(paths["input_dir"])
 
         flash("Alle Dateien wurden erfolgreich gelöscht.", 'success')
@@ -236,6 +435,21 @@ def add_mapping():
             writer = csv.writer(file)
             writer.writerow([verlag, lieferant])
 
+        # Bereits verarbeitete Liste aktualisieren: nur 949$v neu berechnen, aus dem Alma-Frame.
+        # Das Mapping ist zu diesem Zeitpunkt gespeichert; ein Fehler am Frame (nur Zwischenspeicher)
+        # darf die Route nicht scheitern lassen.
+        frame = AlmaFrame(paths["alma_frame"])
+        if frame.exists():
+            try:
+                rows = create_data_processor().reapply_mappings(["949$v"])
+                frame.export_xlsx(paths["output_file"])
+                return jsonify({"message": f"Mapping erfolgreich hinzugefügt. 949$v in {rows} Zeilen aktualisiert."}), 200
+            except Exception as e:
+                print(f"[WARNING] 949$v konnte nicht aus dem Alma-Frame neu berechnet werden: {e}")
+                frame.remove()
+                return jsonify({"message": "Mapping erfolgreich hinzugefügt. Die Ergebnisdatei (output.xlsx) wurde "
+                                           "nicht aktualisiert, bitte die Liste neu verarbeiten."}), 200
+
         return jsonify({"message": "Mapping erfolgreich hinzugefügt."}), 200
 
     except Exception as e:
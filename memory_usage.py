@@ -0,0 +1,38 @@
+"""
+Messung des Speicherverbrauchs (Resident Set Size) des laufenden Prozesses
+"""
+
+import os
+import sys
+
+
+def current_rss_mb():
+    """
+    Aktueller RSS des Prozesses in MB (aus /proc, d.h. nur unter Linux)
+
+    Returns:
+        float | None: RSS in MB, None falls auf dieser Plattform nicht messbar
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            resident_pages = int(statm.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss_mb():
+    """
+    Höchster RSS seit Start des Prozesses in MB. Sinkt nach einer Spitze nicht mehr,
+    taugt also nicht für Vergleiche mit einer Schwelle während des Laufs.
+
+    Returns:
+        float | None: Spitzenwert in MB, None falls nicht messbar (z.B. Windows)
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS liefert Bytes, Linux/BSD Kilobytes
+    return max_rss / (1024 * 1024) if sys.platform == 'darwin' else max_rss / 1024
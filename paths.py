@@ -7,7 +7,11 @@ class PathManager:
     def get_paths(self):
         paths = {
             "output_file": os.path.join(self.project_dir, 'output', 'output.xlsx'),
+            "output_csv": os.path.join(self.project_dir, 'output', 'output.csv'),
+            "alma_frame": os.path.join(self.project_dir, 'output', 'alma_frame.arrow'),
             "input_dir": os.path.join(self.project_dir, 'uploads'),
+            "profiles_dir": os.path.join(self.project_dir, 'profiles'),
+            "upload_index": os.path.join(self.project_dir, 'output', 'upload_index.json'),
             "csv_mapping_949v": os.path.join(self.project_dir, 'Mapping', 'mapping_949v.csv'),
             "csv_mapping_articles": os.path.join(self.project_dir, 'Mapping', 'mapping_articles.csv'),
             "csv_mapping_sonderzeichen": os.path.join(self.project_dir, 'Mapping', 'mapping_sonderzeichen.csv'),
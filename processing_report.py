@@ -0,0 +1,92 @@
+"""
+Sammelt Meldungen aus der Verarbeitung, ohne von Flask abzuhängen.
+Die Routen in main.py wandeln den Report erst am Ende in Flash-Meldungen um.
+"""
+
+from collections import Counter
+
+
+class ProcessingReport:
+    def __init__(self):
+        """
+        Initialisiere einen leeren Report
+        """
+        self.messages = []             # (Text, Kategorie) in Reihenfolge des Auftretens
+        self.file_errors = {}          # Dateipfad -> Fehlermeldung
+        self.files_processed = 0
+        self.rows_written = 0
+        self.rows_skipped = 0          # Zeilen ohne Titel (24510$a)
+        self.unmapped_905n = Counter() # 905$n-Wert -> Anzahl Zeilen ohne 905$c-Mapping
+        self.missing_905n = 0          # Übernommene Zeilen ohne 905$n (Bibliothek)
+        self.output_saved = False
+        self.chunk_size = None         # Blockgrösse im Chunk-Modus (None = ganze Datei)
+        self.peak_rss_mb = None        # Höchster gemessener RSS während des Laufs (ohne /proc: Spitzenwert des Prozesses)
+        self.memory_warning = False    # Warnschwelle für den RSS im Chunk-Modus überschritten
+        self.frame_error = None        # Fehler beim Schreiben des Alma-Frames (Ergebnisdatei ist trotzdem gespeichert)
+
+    def success(self, message):
+        self.messages.append((message, 'success'))
+
+    def error(self, message):
+        self.messages.append((message, 'error'))
+
+    def file_error(self, file, error):
+        """
+        Halte einen Fehler beim Verarbeiten einer einzelnen Eingabedatei fest
+
+        Args:
+            file (str): Pfad der Eingabedatei
+            error (Exception | str): Aufgetretener Fehler
+        """
+        self.file_errors[file] = str(error)
+        self.error(f"Fehler beim Verarbeiten der Datei {file}: {error}")
+
+    def unmapped(self, value_905n):
+        if value_905n:
+            self.unmapped_905n[value_905n] += 1
+        else:
+            self.missing_905n += 1
+
+    def sample_rss(self, rss_mb):
+        if rss_mb is not None and (self.peak_rss_mb is None or rss_mb > self.peak_rss_mb):
+            self.peak_rss_mb = rss_mb
+
+    def has_errors(self):
+        return any(category == 'error' for _, category in self.messages)
+
+    def flash_messages(self):
+        """
+        Liefert alle Meldungen inklusive zusammengefasster Meldungen für nicht
+        gemappte und fehlende 905$n-Codes (eine Meldung statt eine pro Zeile).
+
+        Returns:
+            list: [(Text, Kategorie), ...]
+        """
+        messages = list(self.messages)
+        if self.unmapped_905n:
+            summary = ", ".join(f"'{code}' ({count}x)" for code, count in self.unmapped_905n.most_common())
+            messages.append((f"Kein gültiges 905$c-Mapping für 905$n: {summary}", 'error'))
+        if self.missing_905n:
+            messages.append((f"{self.missing_905n} Zeile(n) ohne 905$n (Bibliothek), 905$c bleibt leer.", 'error'))
+        return messages
+
+    def to_dict(self):
+        """
+        Strukturierte Zusammenfassung für JSON-Antworten
+
+        Returns:
+            dict: Zähler und Fehler des Laufs
+        """
+        return {
+            'files_processed': self.files_processed,
+            'file_errors': dict(self.file_errors),
+            'rows_written': self.rows_written,
+            'rows_skipped': self.rows_skipped,
+            'unmapped_905n': dict(self.unmapped_905n),
+            'missing_905n': self.missing_905n,
+            'output_saved': self.output_saved,
+            'chunk_size': self.chunk_size,
+            'peak_rss_mb': round(self.peak_rss_mb, 1) if self.peak_rss_mb is not None else None,
+            'memory_warning': self.memory_warning,
+            'frame_error': self.frame_error
+        }
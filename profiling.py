@@ -0,0 +1,110 @@
+"""
+Optionales Profiling einzelner Requests mit cProfile
+Die Profile werden im pstats-Format gespeichert (z.B. mit snakeviz oder flameprof auswertbar)
+"""
+
+import cProfile
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+
+class RequestProfiler:
+    def __init__(self, profiles_dir, keep=20):
+        """
+        Initialisiere den RequestProfiler
+
+        Args:
+            profiles_dir (str): Verzeichnis für die Profile
+            keep (int): Anzahl Profile, die behalten werden (ältere werden gelöscht)
+        """
+        self.profiles_dir = profiles_dir
+        self.keep = keep
+        # cProfile erlaubt ab Python 3.12 nur einen aktiven Profiler pro Prozess
+        self._lock = threading.Lock()
+
+    def run(self, name, func, *args, **kwargs):
+        """
+        Führt func unter cProfile aus und speichert das Profil. Läuft bereits ein
+        Profil (oder ein anderes Profiling-Werkzeug), wird func ohne Profiling ausgeführt.
+
+        Args:
+            name (str): Bezeichnung für den Dateinamen (z.B. Endpoint)
+
+        Returns:
+            tuple: (Rückgabewert von func, Dateiname des Profils oder None)
+        """
+        if not self._lock.acquire(blocking=False):
+            print(f"[INFO] Profiling übersprungen ({name}): es läuft bereits ein Profil")
+            return func(*args, **kwargs), None
+
+        try:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError as e:
+                print(f"[WARNING] Profiling nicht möglich ({name}): {e}")
+                profiler = None
+
+            if profiler is None:
+                return func(*args, **kwargs), None
+
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                profiler.disable()
+                filename = self._save(profiler, name, time.perf_counter() - started)
+            return result, filename
+        finally:
+            self._lock.release()
+
+    def _save(self, profiler, name, duration):
+        """Speichert das Profil; ein Fehler dabei lässt den Request nicht scheitern"""
+        try:
+            os.makedirs(self.profiles_dir, exist_ok=True)
+            safe_name = re.sub(r'[^A-Za-z0-9_-]', '_', name or 'request')
+            filename = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}_{safe_name}_{int(duration * 1000)}ms.prof"
+            profiler.dump_stats(os.path.join(self.profiles_dir, filename))
+            self._cleanup()
+        except OSError as e:
+            print(f"[WARNING] Profil konnte nicht gespeichert werden: {e}")
+            return None
+        print(f"[INFO] Profil gespeichert: {filename}")
+        return filename
+
+    def list_profiles(self):
+        """
+        Liste der gespeicherten Profile, neueste zuerst
+
+        Returns:
+            list: [{'name': str, 'size': int, 'created': str}, ...]
+        """
+        if not os.path.isdir(self.profiles_dir):
+            return []
+
+        profiles = []
+        for filename in os.listdir(self.profiles_dir):
+            if not filename.endswith('.prof'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.profiles_dir, filename))
+            except FileNotFoundError:
+                # Gleichzeitig von _cleanup eines anderen Requests gelöscht
+                continue
+            profiles.append({
+                'name': filename,
+                'size': stat.st_size,
+                'created': datetime.fromtimestamp(stat.st_mtime).isoformat(timespec='seconds')
+            })
+        profiles.sort(key=lambda p: p['name'], reverse=True)
+        return profiles
+
+    def _cleanup(self):
+        for profile in self.list_profiles()[self.keep:]:
+            try:
+                os.remove(os.path.join(self.profiles_dir, profile['name']))
+            except OSError:
+                pass
@@ -0,0 +1,149 @@
+"""
+Adaptive Steuerung der SRU-Anfragerate
+Passt die Pause zwischen zwei Anfragen an gemessene Latenz, Fehler und Drosselung (HTTP 429) an
+"""
+
+import time
+from collections import deque
+
+
+class AdaptiveRateController:
+    def __init__(self, min_delay=0.05, max_delay=5.0, initial_delay=0.3, target_latency=1.5, window=20):
+        """
+        Initialisiere den Controller
+
+        Args:
+            min_delay (float): Kleinste Pause zwischen Anfragen in Sekunden (höchste Rate)
+            max_delay (float): Grösste Pause zwischen Anfragen in Sekunden (tiefste Rate)
+            initial_delay (float): Pause zu Beginn des Laufs
+            target_latency (float): Median-Latenz in Sekunden, ab der gebremst wird
+            window (int): Anzahl Anfragen im gleitenden Fenster
+        """
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.delay = min(max(initial_delay, min_delay), max_delay)
+        self.target_latency = target_latency
+
+        # Gleitendes Fenster der letzten Anfragen
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)  # 'ok', 'error', 'timeout' oder 'throttled'
+
+        # Zähler über den ganzen Lauf
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.throttled = 0
+        self.lowest_delay = self.delay
+        self.highest_delay = self.delay
+
+        # Entscheidungen (nur Änderungen der Pause), die letzten 50 werden behalten
+        self.adjustments = 0
+        self.decisions = deque(maxlen=50)
+
+        self._success_streak = 0
+        self._next_request_at = 0.0
+
+    def wait(self):
+        """Wartet, bis die nächste Anfrage gesendet werden darf."""
+        remaining = self._next_request_at - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def record(self, latency, outcome, retry_after=None):
+        """
+        Erfasst das Ergebnis einer Anfrage und passt die Pause an
+
+        Args:
+            latency (float | None): Antwortzeit in Sekunden
+            outcome (str): 'ok', 'error', 'timeout' oder 'throttled'
+            retry_after (float, optional): Wartezeit aus dem Retry-After-Header
+        """
+        self.requests += 1
+        self.outcomes.append(outcome)
+        if latency is not None:
+            self.latencies.append(latency)
+
+        if outcome == 'throttled':
+            self.throttled += 1
+            self._success_streak = 0
+            self._set_delay(max(self.delay * 2, retry_after or 0), 'HTTP 429 (gedrosselt)')
+        elif outcome == 'timeout':
+            self.timeouts += 1
+            self._success_streak = 0
+            self._set_delay(self.delay * 2, 'Timeout')
+        elif outcome == 'error':
+            self.errors += 1
+            self._success_streak = 0
+            if self.error_rate() > 0.2:
+                self._set_delay(self.delay * 1.5, f'Fehlerrate {self.error_rate():.0%}')
+        else:
+            self._success_streak += 1
+            median = self.latency_percentile(50)
+            if median is not None and median > self.target_latency:
+                self._success_streak = 0
+                self._set_delay(self.delay * 1.25, f'Median-Latenz {median:.2f}s')
+            elif self._success_streak >= 5:
+                # Nach fünf schnellen, fehlerfreien Anfragen in Folge die Rate erhöhen
+                self._success_streak = 0
+                self._set_delay(self.delay * 0.8, 'stabil')
+
+        # Bei Drosselung so lange warten, wie der Server verlangt, aber höchstens max_delay.
+        # Die gedrosselte Zeile wird zurückgestellt und am Ende des Laufs erneut abgefragt.
+        pause = min(max(self.delay, retry_after or 0), self.max_delay)
+        self._next_request_at = time.monotonic() + pause
+
+    def error_rate(self):
+        """Anteil fehlgeschlagener Anfragen (Fehler, Timeouts, 429) im Fenster"""
+        if not self.outcomes:
+            return 0.0
+        return sum(1 for o in self.outcomes if o != 'ok') / len(self.outcomes)
+
+    def latency_percentile(self, percentile):
+        """Perzentil der Latenz im Fenster, None wenn noch nichts gemessen wurde"""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(round(percentile / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def summary(self):
+        """
+        Zusammenfassung für die Statistik der Dublettenkontrolle
+
+        Returns:
+            dict: Aktuelle Pause, Grenzen, Latenz, Fehlerraten und letzte Entscheidungen
+        """
+        median = self.latency_percentile(50)
+        p95 = self.latency_percentile(95)
+        return {
+            'delay': round(self.delay, 3),
+            'min_delay': self.min_delay,
+            'max_delay': self.max_delay,
+            'lowest_delay': round(self.lowest_delay, 3),
+            'highest_delay': round(self.highest_delay, 3),
+            'latency_p50': round(median, 3) if median is not None else None,
+            'latency_p95': round(p95, 3) if p95 is not None else None,
+            'requests': self.requests,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'throttled': self.throttled,
+            'error_rate': round(self.error_rate(), 3),
+            'adjustments': self.adjustments,
+            'decisions': list(self.decisions)
+        }
+
+    def _set_delay(self, delay, reason):
+        delay = min(max(delay, self.min_delay), self.max_delay)
+        if abs(delay - self.delay) < 1e-9:
+            return
+
+        self.decisions.append({
+            'request': self.requests,
+            'delay': round(delay, 3),
+            'previous_delay': round(self.delay, 3),
+            'reason': reason
+        })
+        self.adjustments += 1
+        self.delay = delay
+        self.lowest_delay = min(self.lowest_delay, delay)
+        self.highest_delay = max(self.highest_delay, delay)
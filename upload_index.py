@@ -0,0 +1,175 @@
+"""
+Index der hochgeladenen Bestelllisten
+Speichert pro Datei Grösse, Hash, Zeilenzahl, erkannte Spalten und geschätzte Laufzeiten,
+damit die Dateiliste ohne Öffnen der Arbeitsmappen beantwortet werden kann.
+Der Index wird beim Hochladen und Löschen nachgeführt.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import threading
+
+from alma_frame import write_atomic
+
+try:
+    import fcntl
+except ImportError:  # Windows: nur Sperre zwischen Threads (Entwicklungsserver)
+    fcntl = None
+
+# Schätzwerte pro Zeile
+# Verarbeitung: gemessen an einer Liste mit 80'000 Zeilen (ca. 47 s im In-Memory-Modus)
+PROCESSING_SECONDS_PER_ROW = 0.0006
+# Dublettenkontrolle: grobe Annahme, nicht gemessen (Startpause des AdaptiveRateController
+# von 0.3 s plus ca. 0.3 s Antwortzeit von Swisscovery pro Abfrage)
+SRU_SECONDS_PER_ROW = 0.6
+
+
+class UploadIndex:
+    def __init__(self, paths):
+        """
+        Initialisiere den UploadIndex
+
+        Args:
+            paths (dict): Pfade aus PathManager ("upload_index" und "input_dir")
+        """
+        self.paths = paths
+        # Der Index wird gelesen, geändert und zurückgeschrieben. Die Thread-Sperre genügt
+        # nicht, wenn mehrere gunicorn-Worker hochladen; dafür sperrt _locked eine Lock-Datei.
+        self._lock = threading.Lock()
+
+    def add(self, file_path, columns_mapping):
+        """
+        Liest die Datei einmal ein und nimmt sie in den Index auf
+
+        Args:
+            file_path (str): Pfad der hochgeladenen Datei
+            columns_mapping (dict): Alma-Spalte -> erwartete Spalte der Bestellliste
+
+        Returns:
+            dict: Eintrag der Datei
+        """
+        entry = self._describe(file_path, columns_mapping)
+        with self._locked():
+            index = self._load()
+            index[entry['name']] = entry
+            self._save(index)
+        return entry
+
+    def remove(self, filename):
+        with self._locked():
+            index = self._load()
+            if index.pop(filename, None) is not None:
+                self._save(index)
+
+    def clear(self):
+        with self._locked():
+            self._save({})
+
+    def list_files(self):
+        """
+        Dateiliste aus dem Index. Dateien ohne (aktuellen) Indexeintrag werden nur mit
+        Name und Grösse aufgeführt; es wird keine Arbeitsmappe geöffnet.
+
+        Returns:
+            list: [{'name': str, 'size': int, 'indexed': bool, ...}, ...]
+        """
+        index = self._load()
+        files = []
+        for filename in sorted(os.listdir(self.paths["input_dir"])):
+            file_path = os.path.join(self.paths["input_dir"], filename)
+            if not os.path.isfile(file_path):
+                continue
+            stat = os.stat(file_path)
+            entry = index.get(filename)
+            if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+                files.append(dict(entry, indexed=True))
+            else:
+                files.append({'name': filename, 'size': stat.st_size, 'indexed': False})
+        return files
+
+    def _describe(self, file_path, columns_mapping):
+        stat = os.stat(file_path)
+        entry = {
+            'name': os.path.basename(file_path),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'sha256': self._hash(file_path),
+            'rows': None,
+            'columns': [],
+            'header_mapping': {},
+            'missing_columns': [],
+            'error': None,
+            'estimated_processing_seconds': None,
+            'estimated_sru_seconds': None
+        }
+
+        try:
+            header, rows = self._read_summary(file_path)
+            entry['rows'] = rows
+            entry['columns'] = header
+            entry['header_mapping'] = {alma: (source if source in header else None)
+                                       for alma, source in columns_mapping.items()}
+            entry['missing_columns'] = [source for source in columns_mapping.values() if source not in header]
+            entry['estimated_processing_seconds'] = round(rows * PROCESSING_SECONDS_PER_ROW, 1)
+            entry['estimated_sru_seconds'] = round(rows * SRU_SECONDS_PER_ROW, 1)
+        except Exception as e:
+            entry['error'] = str(e)
+
+        return entry
+
+    def _read_summary(self, file_path):
+        """
+        Kopfzeile und Anzahl nicht leerer Datenzeilen (openpyxl read-only)
+
+        Returns:
+            tuple: (Liste der Spaltennamen, Anzahl Zeilen)
+        """
+        from openpyxl import load_workbook
+
+        wb = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            rows = wb.active.iter_rows(values_only=True)
+            header = next(rows, None) or ()
+            header = [str(h).strip() for h in header if h is not None]
+            count = sum(1 for values in rows if any(v not in (None, '') for v in values))
+        finally:
+            wb.close()
+        return header, count
+
+    def _hash(self, file_path):
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Exklusiver Zugriff auf den Index für Threads und Prozesse (fcntl.flock)"""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.paths["upload_index"] + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self):
+        try:
+            with open(self.paths["upload_index"], encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, index):
+        # Atomar ersetzen, damit list_files (ohne Sperre) nie eine halbe Datei liest
+        def write_json(tmp_path):
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                json.dump(index, file, ensure_ascii=False)
+
+        write_atomic(self.paths["upload_index"], write_json)